@@ -1,16 +1,31 @@
 import math
+from typing import Dict, Optional
+
+import numpy as np
 
 from .condition import OperatingCondition
 from .diffuser import VanelessDiffuser, surge_critical_angle
 from .geometry import Geometry
 from .impeller import Impeller
 from .inducer import Inducer
+from .solvers import Solver
 
 
 class Compressor:
-    def __init__(self, geom: Geometry, op: OperatingCondition):
+    def __init__(
+        self,
+        geom: Geometry,
+        op: OperatingCondition,
+        dif_kwargs: Optional[dict] = None,
+        solvers: Optional[Dict[str, Solver]] = None,
+    ):
+        """`dif_kwargs` are the options of the diffuser, e.g. its steps, and
+        `solvers` the strategies of the solves of the stages "ind", "imp" and
+        "dif", the default strategy otherwise"""
         self.geom = geom
         self.op = op
+        self.dif_kwargs = dif_kwargs or {}
+        self.solvers = solvers or {}
 
         self.ind = None
         self.imp = None
@@ -34,9 +49,20 @@ class Compressor:
         self.V_in = self.op.m / op.in0.D
         self.flow = self.V_in / (self.tip_speed * self.geom.r4**2)
 
-    def calculate(self, delta_check=True) -> bool:
+    def calculate(self, delta_check=True, guess: Optional["Compressor"] = None) -> bool:
+        """Solve the stages, starting from the solution of `guess` if given
+
+        `guess` is typically a neighbouring operating point of the same
+        geometry. Its stages that converged give the initial guesses of the
+        stages of this point, which otherwise use their own heuristics.
+        """
         # Inducer
-        self.ind = Inducer(self.geom, self.op)
+        self.ind = Inducer(
+            self.geom,
+            self.op,
+            **self._solver("ind"),
+            **_stage_guess(guess, "ind", self.op.m),
+        )
         if self.ind.choke_flag:
             self.invalid_flag = True
             return False
@@ -44,7 +70,13 @@ class Compressor:
         self.m_in = self.ind.out.c / self.in_.total.A
 
         # Impeller
-        self.imp = Impeller(self.geom, self.op, self.ind)
+        self.imp = Impeller(
+            self.geom,
+            self.op,
+            self.ind,
+            **self._solver("imp"),
+            **_stage_guess(guess, "imp", self.op.m),
+        )
         if self.imp.choke_flag or self.imp.wet:
             self.invalid_flag = True
             return False
@@ -58,7 +90,14 @@ class Compressor:
             return False
 
         # Diffuser
-        self.dif = VanelessDiffuser(self.geom, self.op, self.imp)
+        self.dif = VanelessDiffuser(
+            self.geom,
+            self.op,
+            self.imp,
+            **self.dif_kwargs,
+            **self._solver("dif"),
+            **_stage_guess(guess, "dif", self.op.m),
+        )
         if self.dif.choke_flag:
             self.invalid_flag = True
             return False
@@ -73,16 +112,19 @@ class Compressor:
             self.invalid_flag = True
             return False
 
-        tp_is = self.op.fld.thermo_prop("PS", self.out.total.P, self.in_.total.S)
+        tp_is = self.op.fld.thermo_prop(
+            "PS", self.out.total.P, self.in_.total.S, outputs="H"
+        )
         self.dh0s = tp_is.H - self.in_.total.H
         self.head = self.dh0s / (self.tip_speed**2)
 
-        # Assess surge by calculating dHead/dFlow should be < 0
+        # Assess surge by calculating dHead/dFlow should be < 0, the perturbed
+        # point starts from the solution of this one
         if delta_check:
             d_op = OperatingCondition(**self.op.__dict__)
             d_op.m *= 1.005
-            d_comp = Compressor(self.geom, d_op)
-            if d_comp.calculate(delta_check=False):
+            d_comp = Compressor(self.geom, d_op, self.dif_kwargs, self.solvers)
+            if d_comp.calculate(delta_check=False, guess=self):
                 self.d_head_d_flow = (d_comp.head - self.head) / (
                     d_comp.flow - self.flow
                 )
@@ -98,3 +140,19 @@ class Compressor:
         self.Ds = 2 * self.geom.r4 * self.dh0s**0.25 / sqrt_v_in
 
         return not self.invalid_flag
+
+    def _solver(self, stage: str) -> dict:
+        """Solver argument of `stage`, none for the default strategy"""
+        return {"solver": self.solvers[stage]} if stage in self.solvers else {}
+
+
+def _stage_guess(comp: Optional[Compressor], stage: str, m: float) -> dict:
+    """Guess arguments of a stage from the same stage of `comp`
+
+    The velocities are scaled by the ratio of the mass flows.
+    """
+    s = None if comp is None else getattr(comp, stage)
+    if s is None or s.x is None:
+        return {}
+    x = np.where(s.velocity_unknowns, s.x * (m / comp.op.m), s.x)
+    return {"guess": x, "guess_jac": s.jac}
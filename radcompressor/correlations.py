@@ -1,14 +1,34 @@
 import math
 
-from scipy import optimize
+import numpy as np
 
+# Newton iterations on the Colebrook equation, from Haaland's approximation
+colebrook_iter = 3
 
-def moody(Re: float, r: float) -> float:
-    """Caluclate Moody's coefficient"""
-    if Re < 2300.0:
-        return 64 / Re
 
-    def colebrook(x: float) -> float:
-        return -2 * math.log10(r / 3.72 + 2.51 / Re / x**0.5) - 1 / x**0.5
+def moody(Re, r):
+    """Caluclate Moody's coefficient
 
-    return optimize.fsolve(colebrook, 0.02)[0]
+    Laminar below Re = 2300, Colebrook's equation otherwise. `Re` and the
+    relative roughness `r` can be floats or arrays.
+    """
+    if np.ndim(Re) == 0 and np.ndim(r) == 0:
+        if Re < 2300.0:
+            return 64 / Re
+        return _colebrook(Re, r, math.log10)
+
+    Re, r = np.broadcast_arrays(np.asarray(Re, float), np.asarray(r, float))
+    laminar = Re < 2300.0
+    f = _colebrook(np.where(laminar, 2300.0, Re), r, np.log10)
+    return np.where(laminar, 64 / Re, f)
+
+
+def _colebrook(Re, r, log10):
+    """Colebrook friction factor by Newton iteration on y = 1 / f**0.5"""
+    a = r / 3.72
+    b = 2.51 / Re
+    y = -1.8 * log10((r / 3.7) ** 1.11 + 6.9 / Re)
+    for _ in range(colebrook_iter):
+        x = a + b * y
+        y -= (y + 2 * log10(x)) / (1 + 2 / math.log(10) * b / x)
+    return 1 / y**2
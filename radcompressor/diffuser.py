@@ -1,16 +1,24 @@
+import functools
 import math
 from dataclasses import InitVar, dataclass, field
 from math import cos, pi, sin, tan
+from typing import ClassVar, Optional
 
 import numpy as np
 from numpy.polynomial import polynomial
-from scipy import optimize
 
+from . import thermo
 from .condition import OperatingCondition
 from .geometry import Geometry
 from .impeller import Impeller
 from .inducer import InducerState
-from .thermo import ThermoException, static_from_total
+from .solvers import Solver, with_jacobian
+from .thermo import static_derivatives, static_from_total
+
+# Bounds of the adaptive march: the largest growth of a step after an accepted
+# one and the smallest step, relative to the length of the diffuser
+adaptive_max_growth = 5.0
+adaptive_min_step = 1e-6
 
 
 class VanelessState(InducerState):
@@ -29,6 +37,27 @@ class VanelessDiffuser:
     eff: float = math.nan
     choke_flag = False
     n_steps: int = 15
+    # Solve the stations one at a time, instead of all the speeds at once
+    marching: bool = True
+    # Steps sized by their estimated local error, which meets the relative tolerance
+    # on the total pressure and the tolerance on the flow angle in degrees.
+    # n_steps sets the first step.
+    adaptive: bool = False
+    tol_P0: float = 1e-3
+    tol_alpha: float = 0.5
+    # Initial guess and converged value of the meridional speeds, and their
+    # Jacobians, which are those of the solve of all the speeds at once
+    guess: Optional[np.ndarray] = field(default=None, repr=False)
+    guess_jac: Optional[np.ndarray] = field(default=None, repr=False)
+    x: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    # Radii of the stations of the speeds
+    r: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    jac: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    # Strategy of the solves, and their evaluations and iterations
+    solver: Solver = field(default=Solver(), repr=False)
+    nfev: int = field(default=0, init=False, repr=False)
+    nit: int = field(default=0, init=False, repr=False)
+    velocity_unknowns: ClassVar = True
 
     def __post_init__(
         self, geom: Geometry, op: OperatingCondition, imp: Impeller
@@ -45,63 +74,241 @@ class VanelessDiffuser:
         A_eff = 2 * r[1:] * b[1:] * pi * geom.blockage[4]
 
         k = 0.02
-
-        def resolve_speed(x, return_values=False):
+        L = geom.r5 - geom.r4
+
+        def width(r_):
+            """Width of the diffuser at the radius `r_`"""
+            return geom.b4 + (geom.b5 - geom.b4) * (r_ - geom.r4) / L
+
+        def rates(in_: VanelessState, r_, b_):
+            """Derivatives of the total pressure and of the tangential speed with
+            respect to the radius at the state `in_`, at the radius `r_` and the
+            width `b_`"""
+            # Calculate friction losses
+            Re = in_.c * in_.static.D / in_.static.V * b_
+            Cf = k * (1.8e5 / Re) ** 0.2  # Japikse
+            Dh = (8 * r_ * b_ * geom.blockage[4]) ** 0.5  # Hydraulic
+
+            # Calculate total pressure losses
+            ds = ((1 / tan((90 - in_.alpha) / 180 * pi)) ** 2 + 1) ** 0.5
+            dp0 = 4.0 * Cf * ds * in_.c**2 * in_.static.D / 2 / Dh
+
+            c4t = in_.c * sin(in_.alpha / 180 * pi)
+            c4m = in_.c * cos(in_.alpha / 180 * pi)
+            dCtdr = -(c4t / r_ + Cf * in_.c**2 * sin(in_.alpha / 180 * pi) / c4m / b_)
+            return -dp0, dCtdr
+
+        def total(in_: VanelessState, P0):
+            """Total condition at the pressure `P0`, None if the march fails"""
+            if P0 <= 0 and P0 < op.in0.P:
+                return None
+            tot = op.fld.thermo_prop(
+                "PH", P0, in_.total.H, outputs="A", phase=thermo.gas_hint, errors="nan"
+            )
+            return tot if tot.valid else None
+
+        def advance(in_: VanelessState, i: int):
+            """Tangential speed and total condition at the end of step i of the
+            uniform march from the state `in_` at its start"""
+            dP0dr, dCtdr = rates(in_, r[i], b[i + 1])
+            c5t = in_.c * sin(in_.alpha / 180 * pi) + dCtdr * dr[i]
+            return c5t, total(in_, in_.total.P + dP0dr * dr[i])
+
+        def continuity(in_: VanelessState, A, c5m, c5t, tot):
+            """Residual of the mass flow through the area `A` at the end of a
+            step and the static condition, which is None if the march fails"""
+            c5 = (c5m**2 + c5t**2) ** 0.5
+            if c5 > 1.25 * in_.total.A:
+                # Choke
+                return 1e4, None
+
+            stat = static_from_total(tot, c5, errors="nan")
+            if not stat.valid:
+                return 1e4, None
+
+            err = (op.m - A * c5m * stat.D) / op.m
+            alpha = math.asin(c5t / c5) * 180 / pi
+            m_abs = c5 * cos(alpha / 180 * pi) / stat.A
+            if m_abs >= 0.99:
+                err += m_abs - 0.99
+            return err, stat
+
+        def move(in_: VanelessState, c5m, c5t, tot, stat):
+            """Moves `in_` to the end of the step"""
+            in_.c = (c5m**2 + c5t**2) ** 0.5
+            in_.alpha = math.asin(c5t / in_.c) * 180 / pi
+            in_.total = tot
+            in_.static = stat
+            in_.m_abs = in_.c * cos(in_.alpha / 180 * pi) / in_.static.A
+
+        def restart(in_: VanelessState) -> VanelessState:
+            """Moves the scratch state `in_` back to the inlet"""
+            in_.c, in_.alpha = self.in4.c, self.in4.alpha
+            in_.total, in_.static = self.in4.total, self.in4.static
+            return in_
+
+        # State of the march of the residual of all the speeds, which is reused
+        # by its evaluations. Their states are the conditions and the tangential
+        # speeds of the stations.
+        scratch = VanelessState()
+
+        def resolve_speed(x):
+            in_ = restart(scratch)
+            err = np.full(self.n_steps, 1e4)
+            steps = [None] * self.n_steps
+            for i in range(self.n_steps):
+                c5t, tot = advance(in_, i)
+                stat = None
+                if tot is not None:
+                    err[i], stat = continuity(in_, A_eff[i], x[i], c5t, tot)
+                if stat is None:
+                    return err, None
+                steps[i] = tot, stat, c5t
+                move(in_, x[i], c5t, tot, stat)
+            return err, steps
+
+        def solve_station(in_: VanelessState, A, c5t, tot, start=None):
+            """Meridional speed and static condition at the end of a step, from
+            `start` or from the density of `in_`, None if the solve fails"""
+
+            def station(y):
+                return continuity(in_, A, y[0], c5t, tot)
+
+            def jacobian_station(y, stat):
+                c5m = y[0]
+                c5 = (c5m**2 + c5t**2) ** 0.5
+                D_c, _, _ = static_derivatives(tot, stat, c5)
+                jac = -A * (stat.D + c5m**2 / c5 * D_c) / op.m
+                if abs(c5m) / stat.A >= 0.99:
+                    jac += math.copysign(1 / stat.A, c5m)
+                return jac
+
+            seed = op.m / (A * in_.static.D)
+            fun, jac = with_jacobian(station, jacobian_station)
+            sol = self.solver.root(
+                fun, seed, [seed] if start is None else start, jac=jac
+            )
+            self.nfev += sol.nfev
+            self.nit += sol.nit
+            if not self.solver.accepted(sol):
+                return None
+
+            return sol.x[0], fun.states(sol.x)
+
+        def march(guess: Optional[np.ndarray]):
+            """Solves the continuity one station at a time from the inlet, from
+            the density of the previous station or from `guess`. Returns the
+            radii and speeds of the stations and the outlet state, None if a
+            station fails."""
             in_ = VanelessState.from_state(self.in4)
-            err = []
+            x = np.empty(self.n_steps)
             for i in range(self.n_steps):
-                # Calculate friction losses
-                Re = in_.c * in_.static.D / in_.static.V * b[i + 1]
-                Cf = k * (1.8e5 / Re) ** 0.2  # Japikse
-
-                # Calculate total pressure losses
-                ds = (
-                    (dr[i] / tan((90 - in_.alpha) / 180 * pi)) ** 2 + dr[i] ** 2
-                ) ** 0.5
-                dp0 = 4.0 * Cf * ds * in_.c**2 * in_.static.D / 2 / Dh[i]
-
-                c4t = in_.c * sin(in_.alpha / 180 * pi)
-                c4m = in_.c * cos(in_.alpha / 180 * pi)
-                dCtdr = (
-                    -(
-                        c4t / r[i]
-                        + Cf * in_.c**2 * sin(in_.alpha / 180 * pi) / c4m / b[i + 1]
+                c5t, tot = advance(in_, i)
+                start = None if guess is None else guess[i : i + 1]
+                station = tot and solve_station(in_, A_eff[i], c5t, tot, start)
+                if not station:
+                    return None
+                x[i], stat = station
+                move(in_, x[i], c5t, tot, stat)
+            return r[1:], x, in_
+
+        def march_adaptive():
+            """March with the steps of Heun's method whose error, estimated by
+            the difference with Euler's method, meets `tol_P0` and `tol_alpha`.
+            Returns the radii and speeds of the stations and the outlet state,
+            None if a station fails."""
+            in_ = VanelessState.from_state(self.in4)
+            pred = VanelessState()
+            radii, x = [], []
+            r0, h = geom.r4, L / self.n_steps
+            while r0 < geom.r5:
+                if h < adaptive_min_step * L:
+                    return None
+                r1 = geom.r5 if r0 + 1.1 * h >= geom.r5 else r0 + h
+                b1 = width(r1)
+                A = 2 * r1 * b1 * pi * geom.blockage[4]
+                ct = in_.c * sin(in_.alpha / 180 * pi)
+                cm = in_.c * cos(in_.alpha / 180 * pi)
+
+                # Euler predictor
+                f0 = rates(in_, r0, width(r0))
+                c5t = ct + f0[1] * (r1 - r0)
+                tot = total(in_, in_.total.P + f0[0] * (r1 - r0))
+                station = tot and solve_station(in_, A, c5t, tot)
+                if not station:
+                    return None
+                move(pred, *station[:1], c5t, tot, station[1])
+
+                # Heun corrector, from the speed of the predictor
+                f1 = rates(pred, r1, b1)
+                c5t = ct + 0.5 * (f0[1] + f1[1]) * (r1 - r0)
+                tot = total(in_, in_.total.P + 0.5 * (f0[0] + f1[0]) * (r1 - r0))
+                station = tot and solve_station(in_, A, c5t, tot, [station[0]])
+                if not station:
+                    return None
+
+                err = (
+                    0.5
+                    * (r1 - r0)
+                    * max(
+                        abs(f1[0] - f0[0]) / in_.total.P / self.tol_P0,
+                        abs(f1[1] - f0[1]) / cm * 180 / pi / self.tol_alpha,
                     )
-                    * dr[i]
                 )
-                c5t = c4t + dCtdr
-
-                P0 = in_.total.P - dp0
-                if P0 <= 0 and P0 < op.in0.P:
-                    err.extend((self.n_steps - i) * [1e4])
-                    return err
-                tot = op.fld.thermo_prop("PH", P0, in_.total.H)
+                factor = 0.9 / err**0.5 if err > 0 else adaptive_max_growth
+                if not err <= 1:
+                    # Rejected
+                    h = (r1 - r0) * max(factor, 0.2)
+                    continue
+                h = (r1 - r0) * min(factor, adaptive_max_growth)
+                move(in_, *station[:1], c5t, tot, station[1])
+                radii.append(r1)
+                x.append(station[0])
+                r0 = r1
+            return np.array(radii), np.array(x), in_
+
+        def jacobian_speed(x, states):
+            # Forward-mode derivatives along the march, with the derivatives
+            # of the EOS for the flashes. The viscosity is frozen.
+            n = self.n_steps
+            jac = np.zeros((n, n))
+            c = self.in4.c
+            ct = c * sin(self.in4.alpha / 180 * pi)
+            cm = c * cos(self.in4.alpha / 180 * pi)
+            D, V = self.in4.static.D, self.in4.static.V
+            d_ct, d_cm, d_P0, d_D = np.zeros((4, n))
+            for i, (tot, stat, _) in enumerate(states):
+                d_c = (ct * d_ct + cm * d_cm) / c
+                Re = c * D / V * b[i + 1]
+                Cf = k * (1.8e5 / Re) ** 0.2
+                d_Cf = -0.2 * Cf * (d_c / c + d_D / D)
+
+                dp0 = 2.0 * Cf * dr[i] * c**3 * D / abs(cm) / Dh[i]
+                d_dp0 = dp0 * (d_Cf / Cf + 3 * d_c / c + d_D / D - d_cm / cm)
+                d_P0 = d_P0 - d_dp0
+
+                g = Cf * c * ct / cm
+                d_g = (d_Cf * c * ct + Cf * d_c * ct + Cf * c * d_ct - g * d_cm) / cm
+                c5t = ct * (1 - dr[i] / r[i]) - g * dr[i] / b[i + 1]
+                d_c5t = d_ct * (1 - dr[i] / r[i]) - d_g * dr[i] / b[i + 1]
 
                 c5m = x[i]
+                d_c5m = np.zeros(n)
+                d_c5m[i] = 1.0
                 c5 = (c5m**2 + c5t**2) ** 0.5
-                if c5 > 1.25 * in_.total.A:
-                    # Choke
-                    err.extend((self.n_steps - i) * [1e4])
-                    return err
-
-                try:
-                    stat = static_from_total(tot, c5)
-                except ThermoException:
-                    err.extend((self.n_steps - i) * [1e4])
-                    return err
-
-                err.append((op.m - A_eff[i] * c5m * stat.D) / op.m)
-
-                in_.c = c5
-                in_.alpha = math.asin(c5t / c5) * 180 / pi
-                in_.total = tot
-                in_.static = stat
-                in_.m_abs = in_.c * cos(in_.alpha / 180 * pi) / in_.static.A
-                if in_.m_abs >= 0.99:
-                    err[-1] += in_.m_abs - 0.99
-            if return_values:
-                return err, in_
-            return err
+                d_c5 = (c5m * d_c5m + c5t * d_c5t) / c5
+
+                D_c, D_P, _ = static_derivatives(tot, stat, c5)
+                d_D5 = D_c * d_c5 + D_P * d_P0
+                jac[i] = -A_eff[i] * (stat.D * d_c5m + c5m * d_D5) / op.m
+                if abs(c5m) / stat.A >= 0.99:
+                    jac[i, i] += math.copysign(1 / stat.A, c5m)
+
+                # The meridional speed of the next step is positive
+                c, ct, cm = c5, c5t, abs(c5m)
+                D, V = stat.D, stat.V
+                d_ct, d_cm, d_D = d_c5t, math.copysign(1, c5m) * d_c5m, d_D5
+            return jac
 
         c4m = self.in4.c * cos(self.in4.alpha / 180 * pi)
 
@@ -109,20 +316,40 @@ class VanelessDiffuser:
             self.choke_flag = True
             return
 
-        speed_guess = c4m * r[:-1] / r[1:]
-        sol = optimize.root(resolve_speed, x0=speed_guess)
+        guess, guess_jac = self.guess, self.guess_jac
+        if guess is not None and len(guess) != self.n_steps:
+            guess, guess_jac = None, None
 
-        if (sol.fun > 0.001).any():
+        if self.adaptive:
+            result = march_adaptive()
+        elif self.marching:
+            result = march(guess)
+        else:
+            speed_guess = c4m * r[:-1] / r[1:]
+            fun, jac = with_jacobian(resolve_speed, jacobian_speed)
+            sol = self.solver.root(fun, speed_guess, guess, guess_jac, jac=jac)
+            self.nfev += sol.nfev
+            self.nit += sol.nit
+            result = None
+            if self.solver.accepted(sol):
+                self.jac = sol.jac
+                tot, stat, c5t = fun.states(sol.x)[-1]
+                out = VanelessState.from_state(self.in4)
+                move(out, sol.x[-1], c5t, tot, stat)
+                result = r[1:], sol.x, out
+
+        if result is None:
             self.choke_flag = True
             return
-
-        _, out = resolve_speed(sol.x, return_values=True)
+        self.r, self.x, out = result
         out.m_abs = out.c * cos(out.alpha / 180 * pi) / out.static.A
         if out.m_abs >= 0.99:
             self.choke_flag = True
         self.out = out
 
-        out_is = op.fld.thermo_prop("PS", out.total.P, self.in4.total.S)
+        out_is = op.fld.thermo_prop(
+            "PS", out.total.P, self.in4.total.S, outputs="H", phase=thermo.gas_hint
+        )
         self.out.isentropic = out_is
         self.loss = out.total.H - out_is.H
         self.dh0s = out_is.H - self.in4.total.H
@@ -137,6 +364,7 @@ class VanelessDiffuser:
 # Surge
 
 
+@functools.lru_cache(maxsize=None)
 def _generate_fits():
     mach_values = np.array([0, 0.4, 0.8, 1.2, 1.6])
     b_ratio = np.array([0.05, 0.1, 0.2, 0.3, 0.4])
@@ -185,10 +413,8 @@ def _generate_fits():
     return c12.reshape(shape), c20.reshape(shape)
 
 
-c_12, c_20 = _generate_fits()
-
-
 def surge_critical_angle(r5: float, r4: float, b4: float, m2: float) -> float:
+    c_12, c_20 = _generate_fits()
     ratio = b4 / r4
     length = r5 / r4
 
@@ -1,11 +1,20 @@
 import math
 from dataclasses import dataclass, fields
-from typing import List, Union
+from functools import cached_property
+from types import SimpleNamespace
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
 
 
 @dataclass
 class Geometry:
-    """Class describing the geometry of a radial compressor"""
+    """Class describing the geometry of a radial compressor
+
+    The derived quantities (areas, slip, hydraulic diameter, ...) are computed
+    once and cleared when a field is set. `blockage` is stored as a tuple, so
+    that it is replaced rather than modified in place.
+    """
 
     r1: float  # Inducer inlet radius
     r2s: float  # Shroud tip radius
@@ -28,102 +37,54 @@ class Geometry:
     l_ind: float  # Inducer length
     l_comp: float  # Impeller length --> no impact on calculation
 
-    blockage: List[float]
+    blockage: Tuple[float, ...]
 
-    @property
+    @cached_property
     def r2rms(self):
-        return math.sqrt((self.r2s**2 + self.r2h**2) / 2.0)
+        return _r2rms(self, math)
 
-    @property
+    @cached_property
     def A1_eff(self):
-        return self.r1**2 * math.pi * self.blockage[0]
+        return _A1_eff(self, math)
 
-    @property
+    @cached_property
     def A2_eff(self):
-        return (
-            (self.r2s**2 - self.r2h**2)
-            * math.pi
-            * self.blockage[1]
-            * math.cos(self.alpha2 / 180.0 * math.pi)
-        )
+        return _A2_eff(self, math)
 
-    @property
+    @cached_property
     def A_x(self):
         # Effective area at station 2
-        return (
-            (self.r2s**2 - self.r2h**2)
-            * math.pi
-            * self.blockage[1]
-            * math.cos(self.beta2 / 180.0 * math.pi)
-        )
+        return _A_x(self, math)
 
-    @property
+    @cached_property
     def A_y(self):
         # Effective area at station 3
-        return (
-            (self.r2s**2 - self.r2h**2)
-            * math.pi
-            * math.cos(self.beta2 / 180 * math.pi)
-            - (self.r2s - self.r2h) * self.blade_e * self.n_blades
-        ) * self.blockage[2]
+        return _A_y(self, math)
 
-    @property
+    @cached_property
     def beta2_opt(self):
-        return (
-            math.atan(self.A_x / self.A_y * math.tan(self.beta2 / 180 * math.pi))
-            * 180
-            / math.pi
-        )
+        return _beta2_opt(self, math)
 
-    @property
+    @cached_property
     def slip(self):
         """Slip according to Wiesner-Busemann"""
-        return (
-            1
-            - (math.cos(self.beta4 / 180 * math.pi)) ** 0.5
-            / (self.n_blades + self.n_splits) ** 0.7
-        )
+        return _slip(self, math)
 
     @property
     def eps_limit(self):
         pass
 
-    @property
+    def __setattr__(self, name, value):
+        if name == "blockage":
+            value = tuple(value)
+        super().__setattr__(name, value)
+        if name in _field_names:
+            for k in _derived:
+                self.__dict__.pop(k, None)
+
+    @cached_property
     def hydraulic_diameter(self):
-        la = self.r2h / self.r2s
-        Dh = (
-            2
-            * self.r4
-            * (
-                1.0
-                / (
-                    self.n_blades / math.pi / math.cos(self.beta4 / 180 * math.pi)
-                    + 2.0 * self.r4 / self.b4
-                )
-                + self.r2s
-                / self.r4
-                / (
-                    2.0 / (1.0 - la)
-                    + 2.0
-                    * (self.n_blades)
-                    / math.pi
-                    / (1 + la)
-                    * (
-                        math.sqrt(
-                            1
-                            + (1 + la**2 / 2)
-                            * math.tan(self.beta2s / 180 * math.pi) ** 2
-                        )
-                    )
-                )
-            )
-        )
-        Lh = (
-            self.r4
-            * (1 - self.r2rms * 2 / 0.3048)
-            / (math.cos(self.beta4 / 180 * math.pi))
-        )
-        return Dh, Lh
+        return _hydraulic_diameter(self, math)
 
     @classmethod
     def from_dict(cls, data: dict, blockage: Union[List[float], None] = None):
@@ -144,3 +105,163 @@ class Geometry:
 
         d["blockage"] = blockage
         return cls(**d)
+
+
+# Formulas of the derived quantities, with the functions of `m`: `math` for a
+# `Geometry`, whose scalar properties stay floats, or `_np_math` for the
+# columns of a `GeometryTable`
+
+
+def _r2rms(g, m):
+    return m.sqrt((g.r2s**2 + g.r2h**2) / 2.0)
+
+
+def _A1_eff(g, m):
+    return g.r1**2 * m.pi * g.blockage[0]
+
+
+def _A2_eff(g, m):
+    return (
+        (g.r2s**2 - g.r2h**2)
+        * m.pi
+        * g.blockage[1]
+        * m.cos(g.alpha2 / 180.0 * m.pi)
+    )
+
+
+def _A_x(g, m):
+    return (
+        (g.r2s**2 - g.r2h**2) * m.pi * g.blockage[1] * m.cos(g.beta2 / 180.0 * m.pi)
+    )
+
+
+def _A_y(g, m):
+    return (
+        (g.r2s**2 - g.r2h**2) * m.pi * m.cos(g.beta2 / 180 * m.pi)
+        - (g.r2s - g.r2h) * g.blade_e * g.n_blades
+    ) * g.blockage[2]
+
+
+def _beta2_opt(g, m):
+    return m.atan(g.A_x / g.A_y * m.tan(g.beta2 / 180 * m.pi)) * 180 / m.pi
+
+
+def _slip(g, m):
+    return 1 - (m.cos(g.beta4 / 180 * m.pi)) ** 0.5 / (g.n_blades + g.n_splits) ** 0.7
+
+
+def _hydraulic_diameter(g, m):
+    la = g.r2h / g.r2s
+    Dh = (
+        2
+        * g.r4
+        * (
+            1.0 / (g.n_blades / m.pi / m.cos(g.beta4 / 180 * m.pi) + 2.0 * g.r4 / g.b4)
+            + g.r2s
+            / g.r4
+            / (
+                2.0 / (1.0 - la)
+                + 2.0
+                * (g.n_blades)
+                / m.pi
+                / (1 + la)
+                * (m.sqrt(1 + (1 + la**2 / 2) * m.tan(g.beta2s / 180 * m.pi) ** 2))
+            )
+        )
+    )
+    Lh = g.r4 * (1 - g.r2rms * 2 / 0.3048) / (m.cos(g.beta4 / 180 * m.pi))
+    return Dh, Lh
+
+
+# NumPy functions under the names of `math`
+_np_math = SimpleNamespace(
+    pi=np.pi, sqrt=np.sqrt, cos=np.cos, tan=np.tan, atan=np.arctan
+)
+
+
+def _columns(formula) -> cached_property:
+    """Derived quantity of all the rows of a `GeometryTable`"""
+    return cached_property(lambda table: formula(table, _np_math))
+
+
+_field_names = frozenset(f.name for f in fields(Geometry))
+_derived = tuple(k for k, v in vars(Geometry).items() if isinstance(v, cached_property))
+
+
+@dataclass
+class GeometryTable:
+    """Geometries stored by column
+
+    `columns` maps the fields of `Geometry` to arrays, `blockage` has the shape
+    (5, n). The derived quantities of `Geometry` are available for all the rows
+    at once, and `table[geom_id]` gives the `Geometry` of a row, which is built
+    on first access only.
+    """
+
+    geom_id: np.ndarray
+    columns: Dict[str, np.ndarray]
+
+    def __post_init__(self):
+        self.geom_id = np.asarray(self.geom_id)
+        self._index = {g: i for i, g in enumerate(self.geom_id.tolist())}
+        self._views: Dict[int, Geometry] = {}
+
+    @classmethod
+    def from_columns(cls, data, blockage=None):
+        """Create a table from a pyarrow Table, a DataFrame or a dict of arrays
+
+        The blockage is taken from the columns "blockage1" to "blockage5" if
+        not given. The ids are taken from the "geom_id" column or the index of a
+        DataFrame if present, and are the row numbers otherwise.
+        """
+        names = data.column_names if hasattr(data, "column_names") else data.keys()
+        cols = {k.lower(): np.asarray(data[k]) for k in names}
+        n = len(next(iter(cols.values())))
+
+        if blockage is None and "blockage1" in cols:
+            blockage = [cols.pop(f"blockage{i+1}") for i in range(5)]
+        if blockage is None:
+            raise ValueError("Blockage needs to be provided as an argument or in data.")
+        blockage = np.broadcast_to(np.asarray(blockage, float).T, (n, 5)).T
+
+        if "geom_id" in cols:
+            geom_id = cols.pop("geom_id")
+        elif getattr(getattr(data, "index", None), "name", None) == "geom_id":
+            geom_id = data.index.to_numpy()
+        else:
+            geom_id = np.arange(n)
+
+        missing = _field_names - {"blockage"} - cols.keys()
+        if missing:
+            raise ValueError(f"Missing geometry columns: {', '.join(sorted(missing))}")
+        cols = {k: v for k, v in cols.items() if k in _field_names}
+        cols["blockage"] = blockage
+        return cls(geom_id, cols)
+
+    def __len__(self) -> int:
+        return len(self.geom_id)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, geom_id) -> Geometry:
+        try:
+            return self._views[geom_id]
+        except KeyError:
+            pass
+        i = self._index[geom_id]
+        d = {k: v[i].item() for k, v in self.columns.items() if k != "blockage"}
+        geom = Geometry(**d, blockage=tuple(self.blockage[:, i].tolist()))
+        return self._views.setdefault(geom_id, geom)
+
+    r2rms = _columns(_r2rms)
+    A1_eff = _columns(_A1_eff)
+    A2_eff = _columns(_A2_eff)
+    A_x = _columns(_A_x)
+    A_y = _columns(_A_y)
+    beta2_opt = _columns(_beta2_opt)
+    slip = _columns(_slip)
+    hydraulic_diameter = _columns(_hydraulic_diameter)
@@ -1,15 +1,32 @@
 import math
-from dataclasses import InitVar, dataclass, field
+from dataclasses import InitVar, dataclass, field, replace
 from math import atan, cos, pi, sin, tan
-from typing import List
+from typing import ClassVar, List, Optional
 
-from scipy import optimize
+import numpy as np
+from scipy.linalg import block_diag
 
 from .condition import OperatingCondition
 from .correlations import moody
 from .geometry import Geometry
+from . import thermo
 from .inducer import Inducer, InducerState
-from .thermo import ThermoException, ThermoProp, static_from_total, total_from_static
+from .solvers import (
+    Solver,
+    bracketed_root,
+    fd_step,
+    forward_difference,
+    sub_guess,
+    with_jacobian,
+)
+from .thermo import (
+    ThermoException,
+    ThermoProp,
+    max_mass_flux,
+    static_derivatives,
+    static_from_total,
+    total_from_static,
+)
 
 
 @dataclass
@@ -46,6 +63,17 @@ class Impeller:
     eff: float = math.nan
     choke_flag = False
     wet = False
+    # Initial guess and converged value of (w3, beta4, w4, dh_losses, P4_rel),
+    # and their Jacobians
+    guess: Optional[np.ndarray] = field(default=None, repr=False)
+    guess_jac: Optional[np.ndarray] = field(default=None, repr=False)
+    x: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    jac: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    # Strategy of the solves, and their evaluations and iterations
+    solver: Solver = field(default=Solver(), repr=False)
+    nfev: int = field(default=0, init=False, repr=False)
+    nit: int = field(default=0, init=False, repr=False)
+    velocity_unknowns: ClassVar = (True, False, True, False, False)
 
     def __post_init__(
         self, geom: Geometry, op: OperatingCondition, ind: Inducer
@@ -171,12 +199,13 @@ class Impeller:
             self.choke_flag = True
             return
 
-        beta2_opt = atan(geom.A_x / geom.A_y * tan(geom.beta2 / 180 * pi)) * 180 / pi
         # according to Stanitz-Galvas
-        dh_inc = 0.5 * (w2 * sin(abs(abs(beta2_f) - abs(beta2_opt)) / 180 * pi)) ** 2
+        dh_inc = (
+            0.5 * (w2 * sin(abs(abs(beta2_f) - abs(geom.beta2_opt)) / 180 * pi)) ** 2
+        )
         try:
             rel3_temp = op.fld.thermo_prop(
-                "HS", self.in2.relative.H - dh_inc, self.in2.relative.S
+                "HS", self.in2.relative.H - dh_inc, self.in2.relative.S, outputs="P"
             )
         except ThermoException:
             self.choke_flag = True
@@ -187,22 +216,49 @@ class Impeller:
 
         # Resolve static 3
         def resolve_static(x):
-            try:
-                stat3 = static_from_total(self.in2.relative, x)
-            except ThermoException:
-                return 1e4
-
-            return (op.m - geom.A_y * x * stat3.D) / op.m
-
+            w3 = x[0]
+            stat3 = static_from_total(self.in2.relative, w3, outputs="D", errors="nan")
+            if not stat3.valid:
+                return 1e4, None
+
+            return (op.m - geom.A_y * w3 * stat3.D) / op.m, stat3
+
+        def jacobian_static(x, stat3):
+            w3 = x[0]
+            D_w, _, _ = static_derivatives(self.in2.relative, stat3, w3)
+            return -geom.A_y * (stat3.D + w3 * D_w) / op.m
+
+        # The throat chokes above the largest mass flux, the relative speed is
+        # on the subsonic branch below the sonic speed otherwise
+        sonic = max_mass_flux(self.in2.relative)
+        self.nfev += sonic.nfev
+        self.nit += sonic.nit
+        fun, jac = with_jacobian(resolve_static, jacobian_static)
+        guess, guess_jac = sub_guess(self.guess, self.guess_jac, slice(1))
         w3_guess = 0.65 * self.in2.relative.A
-        # w_guess = ind.m / geom.A_y / self.in2.relative.D
-        sol = optimize.root(resolve_static, x0=w3_guess)
-        if (sol.fun > 0.001).any():
+        if sonic.success:
+            if op.m >= geom.A_y * sonic.flux:
+                self.choke_flag = True
+                return
+            f_sonic = (op.m - geom.A_y * sonic.flux) / op.m
+            start = w3_guess if guess is None else guess
+            sol = bracketed_root(fun, 0.0, sonic.x[0], 1.0, f_sonic, start, jac)
+            if not sol.success:
+                # An invalid state inside the bracket, solve without it
+                self.nfev += sol.nfev
+                self.nit += sol.nit
+                sol = self.solver.root(fun, w3_guess, guess, guess_jac, jac=jac)
+        else:
+            sol = self.solver.root(fun, w3_guess, guess, guess_jac, jac=jac)
+        self.nfev += sol.nfev
+        self.nit += sol.nit
+        if not self.solver.accepted(sol):
             self.choke_flag = True
             return
 
         w3_throat = sol.x[0]
-        self.in3.static = static_from_total(self.in2.relative, w3_throat)
+        jac_w3 = sol.jac
+        self.in3.static = fun.states(sol.x).with_outputs()
 
         c3_m = c2_m * geom.A_x / geom.A_y
         c3 = c3_m / cos(geom.alpha2 * pi / 180)
@@ -232,71 +288,111 @@ class Impeller:
             return
         A4_total = 2 * pi * geom.r4 * geom.b4 * geom.blockage[3]
 
-        def resolve_discharge_triangle(x: List[float]) -> List[float]:
-            beta4_f, w4, dh_losses, p4_rel = x
+        def discharge_closure(x: List[float], tp4_stat: ThermoProp) -> List[float]:
+            """Residuals of the flow, of the flow angle and of the external
+            losses, and the internal losses, at the static state `tp4_stat`"""
+            beta4_f, w4, dh_losses, _ = x
 
-            dh_lo = dh_losses
-            if dh_losses < 0:
-                dh_lo = 0
+            # Part 1 Triangle Discharge
+            A4_rel = A4_total * cos(beta4_f * pi / 180)
+            err = [(op.m - A4_rel * w4 * tp4_stat.D) / op.m]
 
-            p4r = p4_rel
-            if p4_rel <= 0:
-                p4r = tp4_rel.P
+            c4m = op.m / A4_total / tp4_stat.D
+            c4t = c4m * tan(geom.beta4 / 180 * pi) + geom.slip * (geom.r4 * op.n_rot)
+            w4t = (geom.r4 * op.n_rot) - c4t
+
+            w4_new = (w4t**2 + c4m**2) ** 0.5
+            beta4_f_new = -math.asin(w4t / w4_new) * 180 / pi
+            err.append((beta4_f_new - beta4_f) / 60.0)
 
-            err = []
-            try:
-                tp4_r = op.fld.thermo_prop("PH", p4r, h4_rel + dh_lo)
-                # Part 1 Triangle Discharge
-                A4_rel = A4_total * cos(beta4_f * pi / 180)
+            # Part 2 Pressure
+            c4 = (c4t**2 + c4m**2) ** 0.5
+            alpha = atan(c4t / c4m) * 180 / pi
 
-                tp4_stat = static_from_total(tp4_r, w4)
+            # Total enthalpy of the static state at c4
+            h4_stat = h4_rel + max(dh_losses, 0) - 0.5 * w4**2
+            out_H = h4_stat + 0.5 * c4**2 - self.in2.total.H
+            Df = self.diffusion_factor(geom, out_H, w4, op.n_rot)
 
-                err.append((op.m - A4_rel * w4 * tp4_stat.D) / op.m)
+            # Calculate internal losses
+            dh_sf = self.skin_friction_losses(geom, w4, tp4_stat)
+            dh_bl = self.blade_loading_losses(geom, Df, op.n_rot)
+            dh_cl = self.clearance_losses(geom, tp4_stat, c4t, op.n_rot)
+            dh_losses_int = dh_sf + dh_bl + dh_cl + dh_inc
 
-                c4m = op.m / A4_total / tp4_stat.D
-                c4t = c4m * tan(geom.beta4 / 180 * pi) + geom.slip * (
-                    geom.r4 * op.n_rot
-                )
-                w4t = (geom.r4 * op.n_rot) - c4t
+            # Calculate external losses
+            dh_df = self.disc_friction_losses(geom, tp4_stat, op.m, op.n_rot)
+            dh_r = self.recirculation_losses(geom, Df, alpha, op.n_rot)
+            dh_losses_ext = dh_df + dh_r
 
-                w4_new = (w4t**2 + c4m**2) ** 0.5
-                beta4_f_new = -math.asin(w4t / w4_new) * 180 / pi
-                err.append((beta4_f_new - beta4_f) / 60.0)
+            err.append((dh_losses_ext - dh_losses) / self.in2.relative.H)
+            return err + [dh_losses_int]
 
-                # Part 2 Pressure
-                c4 = (c4t**2 + c4m**2) ** 0.5
-                alpha = atan(c4t / c4m) * 180 / pi
+        def resolve_discharge_triangle(x: List[float]):
+            _, w4, dh_losses, p4_rel = x
 
-                tp4_tot = total_from_static(tp4_stat, c4)
-                out_H = tp4_tot.H - self.in2.total.H
-                Df = self.diffusion_factor(geom, out_H, w4, op.n_rot)
+            dh_lo = dh_losses
+            if dh_losses < 0:
+                dh_lo = 0
 
-                # Calculate internal losses
-                dh_sf = self.skin_friction_losses(geom, w4, tp4_stat)
-                dh_bl = self.blade_loading_losses(geom, Df, op.n_rot)
-                dh_cl = self.clearance_losses(geom, tp4_stat, c4t, op.n_rot)
-                dh_losses_int = dh_sf + dh_bl + dh_cl + dh_inc
+            p4r = p4_rel
+            if p4_rel <= 0:
+                p4r = tp4_rel.P
 
-                # Calculate external losses
-                dh_df = self.disc_friction_losses(geom, tp4_stat, op.m, op.n_rot)
-                dh_r = self.recirculation_losses(geom, Df, alpha, op.n_rot)
-                dh_losses_ext = dh_df + dh_r
+            failed = [1e4] * 4
+            tp4_r = op.fld.thermo_prop(
+                "PH",
+                p4r,
+                h4_rel + dh_lo,
+                outputs="P",
+                phase=thermo.gas_hint,
+                errors="nan",
+            )
+            if not tp4_r.valid:
+                return failed, None
+
+            tp4_stat = static_from_total(tp4_r, w4, outputs="DV", errors="nan")
+            if not tp4_stat.valid:
+                return failed, None
+
+            *err, dh_losses_int = discharge_closure(x, tp4_stat)
+
+            # Correct pressure
+            tp4_temp = op.fld.thermo_prop(
+                "HS",
+                h4_rel - dh_losses_int,
+                self.in2.relative.S,
+                outputs="PD",
+                errors="nan",
+            )
+            if not tp4_temp.valid:
+                return err + failed[3:], None
 
-                err.append((dh_losses_ext - dh_losses) / self.in2.relative.H)
+            err.append(
+                (tp4_temp.P - tp4_r.P) / self.in2.relative.P + (abs(p4_rel - p4r))
+            )
+            return err, (tp4_r, tp4_stat, tp4_temp)
 
-                # Correct pressure
-                tp4_temp = op.fld.thermo_prop(
-                    "HS", h4_rel - dh_losses_int, self.in2.relative.S
-                )
+        def jacobian_discharge(x: List[float], states) -> np.ndarray:
+            # Chain rule through the flashes, with the derivatives of the EOS,
+            # and forward differences of the closure, which has no flash. The
+            # viscosity is frozen.
+            _, w4, dh_losses, p4_rel = x
+            tp4_r, tp4_stat, tp4_temp = states
 
-                err.append(
-                    (tp4_temp.P - tp4_r.P) / self.in2.relative.P + (abs(p4_rel - p4r))
-                )
+            D_w, D_P, D_H = static_derivatives(tp4_r, tp4_stat, w4)
+            D_x = np.array([0.0, D_w, D_H * (dh_losses >= 0), D_P * (p4_rel > 0)])
 
-            except ThermoException:
-                err.extend([1e4] * (4 - len(err)))
+            f0 = np.array(discharge_closure(x, tp4_stat))
+            jac = forward_difference(lambda y: discharge_closure(y, tp4_stat), x, f0)
+            h = fd_step * tp4_stat.D
+            tp4_h = replace(tp4_stat, D=tp4_stat.D + h)
+            jac += np.outer((discharge_closure(x, tp4_h) - f0) / h, D_x)
 
-            return err
+            # Pressure of the internal losses along the isentrope, dP = D * dh
+            jac[3] *= -tp4_temp.D / self.in2.relative.P
+            jac[3, 3] -= 1 / self.in2.relative.P if p4_rel > 0 else 1
+            return jac
 
         # Guesses
         beta4_f0 = geom.beta4 - 10.0
@@ -307,19 +403,34 @@ class Impeller:
 
         dh_df_guess = self.disc_friction_losses(geom, tp4_rel, op.m, op.n_rot)
 
-        sol = optimize.root(
-            resolve_discharge_triangle,
-            x0=[beta4_f0, w4_guess, dh_df_guess, tp4_rel.P],
+        fun, jac = with_jacobian(resolve_discharge_triangle, jacobian_discharge)
+        sol = self.solver.root(
+            fun,
+            [beta4_f0, w4_guess, dh_df_guess, tp4_rel.P],
+            *sub_guess(self.guess, self.guess_jac, slice(1, None)),
+            jac=jac,
             tol=1e-4,
         )
-        if (sol.fun > 0.001).any():
+        self.nfev += sol.nfev
+        self.nit += sol.nit
+        if not self.solver.accepted(sol):
             self.choke_flag = True
             return
 
         beta4_f, w4, dh_losses, p4_rel = sol.x
+        self.x = np.array([w3_throat, *sol.x])
+        self.jac = block_diag(jac_w3, sol.jac)
         self.out.w = w4
-        self.out.relative = op.fld.thermo_prop("PH", p4_rel, h4_rel + dh_losses)
-        self.out.static = static_from_total(self.out.relative, w4)
+        if dh_losses >= 0 and p4_rel > 0:
+            # The states of the solution, where the residuals are not clipped
+            tp4_r, tp4_stat, _ = fun.states(sol.x)
+            self.out.relative = tp4_r.with_outputs()
+            self.out.static = tp4_stat.with_outputs()
+        else:
+            self.out.relative = op.fld.thermo_prop(
+                "PH", p4_rel, h4_rel + dh_losses, phase=thermo.gas_hint
+            )
+            self.out.static = static_from_total(self.out.relative, w4)
 
         c4m = op.m / A4_total / self.out.static.D
         c4t = c4m * tan(geom.beta4 / 180 * pi) + geom.slip * (geom.r4 * op.n_rot)
@@ -333,7 +444,11 @@ class Impeller:
             print(c4, w4)
             raise
         self.out.isentropic = op.fld.thermo_prop(
-            "PS", self.out.total.P, self.in2.static.S
+            "PS",
+            self.out.total.P,
+            self.in2.static.S,
+            outputs="H",
+            phase=thermo.gas_hint,
         )
 
         out_H = self.out.total.H - self.in2.total.H
@@ -1,13 +1,21 @@
 import math
 from dataclasses import InitVar, dataclass, field, fields
-from typing import Type, TypeVar
+from typing import ClassVar, Optional, Type, TypeVar
 
-from scipy import optimize
+import numpy as np
+from scipy.linalg import block_diag
 
 from .condition import OperatingCondition
 from .correlations import moody
 from .geometry import Geometry
-from .thermo import ThermoException, ThermoProp, static_from_total
+from .solvers import Solver, bracketed_root, sub_guess, with_jacobian
+from .thermo import (
+    ThermoException,
+    ThermoProp,
+    max_mass_flux,
+    static_derivatives,
+    static_from_total,
+)
 
 
 State = TypeVar("State", bound="InducerState")
@@ -46,6 +54,16 @@ class Inducer:
     eff: float = math.nan
     choke_flag: bool = False
     heat: float = 0
+    # Initial guess and converged value of (c1, c2, P2), and their Jacobians
+    guess: Optional[np.ndarray] = field(default=None, repr=False)
+    guess_jac: Optional[np.ndarray] = field(default=None, repr=False)
+    x: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    jac: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+    # Strategy of the solves, and their evaluations and iterations
+    solver: Solver = field(default=Solver(), repr=False)
+    nfev: int = field(default=0, init=False, repr=False)
+    nit: int = field(default=0, init=False, repr=False)
+    velocity_unknowns: ClassVar = (True, True, False)
 
     def __post_init__(self, geom: Geometry, op: OperatingCondition) -> None:
         self.in1 = InducerState(total=op.in0)
@@ -61,48 +79,89 @@ class Inducer:
         in_total = self.in1.total
 
         def resolve_c1(x):
-            c1 = x
-            try:
-                Stat1 = static_from_total(in_total, c1)
-                err1 = (op.m - geom.A1_eff * c1 * Stat1.D) / op.m
-            except ThermoException:
-                return 1e3
-            else:
-                return err1
+            c1 = x[0]
+            Stat1 = static_from_total(in_total, c1, outputs="D", errors="nan")
+            if not Stat1.valid:
+                return 1e3, None
+            return (op.m - geom.A1_eff * c1 * Stat1.D) / op.m, Stat1
+
+        def jacobian_c1(x, Stat1):
+            c1 = x[0]
+            D_c, _, _ = static_derivatives(in_total, Stat1, c1)
+            return -geom.A1_eff * (Stat1.D + c1 * D_c) / op.m
 
         def resolve_out(x):
             c2, Pout = x
-            try:
-                Tot2 = op.fld.thermo_prop("PH", Pout, in_total.H + self.heat / op.m)
-                Stat2 = static_from_total(Tot2, c2)
-
-                err2 = (op.m - geom.A2_eff * c2 * Stat2.D) / op.m
-
-                Re = c2 * 2 * geom.r2s * Stat2.D / Stat2.V
-                Cf = moody(Re, geom.rug_ind / (2 * geom.r2s))
-                dP = 4 * Cf * geom.l_ind * c2**2 / (4 * geom.r2s) * Stat2.D
-                Pout_calc = in_total.P - dP
-                err3 = (Pout_calc - Tot2.P) / in_total.P
-            except ThermoException:
-                return [1e3, 1e3]
-            else:
-                return [err2, err3]
-
-        c1_guess = op.m / geom.A1_eff / in_total.D
-        if c1_guess / in_total.A > 1.5:
-            self.choke_flag = True
-            return
-
-        sol = optimize.root(resolve_c1, x0=c1_guess)
-        if (sol.fun > 0.001).any():
+            Tot2 = op.fld.thermo_prop(
+                "PH", Pout, in_total.H + self.heat / op.m, outputs="P", errors="nan"
+            )
+            if not Tot2.valid:
+                return [1e3, 1e3], None
+            Stat2 = static_from_total(Tot2, c2, outputs="DV", errors="nan")
+            if not Stat2.valid:
+                return [1e3, 1e3], None
+
+            err2 = (op.m - geom.A2_eff * c2 * Stat2.D) / op.m
+
+            Re = c2 * 2 * geom.r2s * Stat2.D / Stat2.V
+            Cf = moody(Re, geom.rug_ind / (2 * geom.r2s))
+            dP = 4 * Cf * geom.l_ind * c2**2 / (4 * geom.r2s) * Stat2.D
+            Pout_calc = in_total.P - dP
+            err3 = (Pout_calc - Tot2.P) / in_total.P
+            return [err2, err3], (Tot2, Stat2, dP)
+
+        def jacobian_out(x, states):
+            # The friction coefficient is frozen
+            c2, _ = x
+            Tot2, Stat2, dP = states
+            D = Stat2.D
+            D_c, D_P, _ = static_derivatives(Tot2, Stat2, c2)
+            return [
+                [-geom.A2_eff * (D + c2 * D_c) / op.m, -geom.A2_eff * c2 * D_P / op.m],
+                [
+                    -dP * (2 / c2 + D_c / D) / in_total.P,
+                    -(dP * D_P / D + 1) / in_total.P,
+                ],
+            ]
+
+        # The flow chokes above the largest mass flux, the inlet speed is on
+        # the subsonic branch below the sonic speed otherwise
+        sonic = max_mass_flux(in_total)
+        self.nfev += sonic.nfev
+        self.nit += sonic.nit
+        fun, jac = with_jacobian(resolve_c1, jacobian_c1)
+        guess, guess_jac = sub_guess(self.guess, self.guess_jac, slice(1))
+        if sonic.success:
+            if op.m >= geom.A1_eff * sonic.flux:
+                self.choke_flag = True
+                return
+            c1_guess = op.m / geom.A1_eff / in_total.D if guess is None else guess
+            f_sonic = (op.m - geom.A1_eff * sonic.flux) / op.m
+            sol = bracketed_root(fun, 0.0, sonic.x[0], 1.0, f_sonic, c1_guess, jac)
+            if not sol.success:
+                # An invalid state inside the bracket, solve without it
+                self.nfev += sol.nfev
+                self.nit += sol.nit
+                c1_guess = op.m / geom.A1_eff / in_total.D
+                sol = self.solver.root(fun, c1_guess, guess, guess_jac, jac=jac)
+        else:
+            c1_guess = op.m / geom.A1_eff / in_total.D
+            if c1_guess / in_total.A > 1.5:
+                self.choke_flag = True
+                return
+            sol = self.solver.root(fun, c1_guess, guess, guess_jac, jac=jac)
+        self.nfev += sol.nfev
+        self.nit += sol.nit
+        if not self.solver.accepted(sol):
             self.choke_flag = True
             return
 
         c1 = sol.x[0]
+        jac_c1 = sol.jac
         # Assign input state
         self.in1.c = c1
         self.in1.A_eff = geom.A1_eff
-        self.in1.static = static_from_total(in_total, c1)
+        self.in1.static = fun.states(sol.x).with_outputs()
         self.in1.m_abs = c1 / self.in1.static.A
 
         # Test for Choke
@@ -117,20 +176,32 @@ class Inducer:
 
         Pout_guess = self.in1.total.P - dP
 
-        sol = optimize.root(resolve_out, x0=[c2_guess, Pout_guess], tol=1e-4)
-        if (sol.fun > 0.001).any():
+        fun, jac = with_jacobian(resolve_out, jacobian_out)
+        sol = self.solver.root(
+            fun,
+            [c2_guess, Pout_guess],
+            *sub_guess(self.guess, self.guess_jac, slice(1, None)),
+            jac=jac,
+            tol=1e-4,
+        )
+        self.nfev += sol.nfev
+        self.nit += sol.nit
+        if not self.solver.accepted(sol):
             self.choke_flag = True
             return sol
 
         c2, Pout = sol.x
+        self.x = np.array([c1, c2, Pout])
+        self.jac = block_diag(jac_c1, sol.jac)
 
-        # Assign output state
+        # Assign output state, from the states of the solution
+        Tot2, Stat2, _ = fun.states(sol.x)
         self.out = InducerState(
-            total=op.fld.thermo_prop("PH", Pout, in_total.H + self.heat / op.m),
-            isentropic=op.fld.thermo_prop("PS", Pout, in_total.S),
+            total=Tot2.with_outputs(),
+            isentropic=op.fld.thermo_prop("PS", Pout, in_total.S, outputs="H"),
         )
         self.out.c = c2
-        self.out.static = static_from_total(self.out.total, c2)
+        self.out.static = Stat2.with_outputs()
         self.out.m_abs = c2 / self.out.static.A
         self.out.A_eff = geom.A2_eff
 
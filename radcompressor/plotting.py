@@ -1,13 +1,16 @@
-try:
-    import CoolProp as CP
-    from CoolProp.Plots import PropertyPlot, StateContainer
-except ImportError:
-    CP, PropertyPlot, StateContainer = None, None, None
+from typing import TYPE_CHECKING
 
 from .compressor import Compressor
 
+if TYPE_CHECKING:
+    from CoolProp.Plots import PropertyPlot
+
+
+def plot_compressor_cycle(comp: Compressor, plot_type="Ts") -> "PropertyPlot":
+    # CoolProp.Plots imports matplotlib, only load it when plotting
+    import CoolProp as CP
+    from CoolProp.Plots import PropertyPlot, StateContainer
 
-def plot_compressor_cycle(comp: Compressor, plot_type="Ts") -> PropertyPlot:
     plot = PropertyPlot(comp.op.fld.name.capitalize(), plot_type)
     plot.calc_isolines(CP.iQ, num=11)
     plot.calc_isolines(CP.iP, num=15)
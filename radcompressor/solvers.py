@@ -0,0 +1,439 @@
+"""Root finding of the residuals of the stages"""
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from scipy import linalg, optimize
+
+# Largest number of evaluations from a guess, per unknown plus one. A good
+# guess converges in a few iterations, a bad one is abandoned early.
+guess_maxfev = 5
+
+# Newton iterations from the guess, which are abandoned when the largest
+# residual increases
+newton_max_iter = 8
+# Relative tolerance on the unknowns, that of "hybr". The superlinear
+# convergence makes it cheap, and the surge check needs accurate solutions.
+newton_tol = 1.49012e-8
+
+# Relative step of the forward differences, that of "hybr"
+fd_step = 1.49012e-8
+
+# Iterations from the starting point of a stage, and the relative
+# decrease of the squared residuals required by the line search of the
+# "newton" method and its halvings of the step
+line_search_max_iter = 50
+sufficient_decrease = 2e-4
+max_halvings = 10
+
+# Methods of `Solver`
+solver_methods = ("hybr", "lm", "newton", "broyden1", "anderson", "lite")
+
+# Iterations of the bracketed scalar solves, which halve the bracket at worst
+bracket_max_iter = 60
+
+# Smallest residual of the stages at an invalid state, e.g. a failed flash
+sentinel_residual = 1e3
+
+# Evaluations of the residuals whose states are kept, the solvers may end on
+# an earlier point than the last one they evaluated
+kept_evaluations = 4
+
+# Jacobians of the stages from the states of their residuals, the forward
+# differences of "hybr" otherwise
+analytic_jacobians = True
+
+
+@dataclass(frozen=True)
+class Solver:
+    """Strategy of the root finding of a stage
+
+    `method` is "hybr" or "lm" of MINPACK, "newton" for Newton's method with a
+    backtracking line search, "broyden1" or "anderson" of `optimize.root`, or
+    "lite" for Newton's method without line search and without SciPy. Newton's
+    method is tried first from the guess of a stage if `warm_newton`, then the
+    method with few evaluations from the guess, and from the starting point of
+    the stage if the solution is not accepted. A solution is accepted when no
+    residual exceeds `accept`, and `tol` overrides the tolerances of the
+    stages on the unknowns.
+    """
+
+    method: str = "hybr"
+    tol: Optional[float] = None
+    accept: float = 0.001
+    warm_newton: bool = True
+
+    def __post_init__(self):
+        if self.method not in solver_methods:
+            raise ValueError(f"Unknown solver method {self.method!r}")
+
+    def accepted(self, sol: optimize.OptimizeResult) -> bool:
+        """Whether no residual of `sol` exceeds `accept`"""
+        return not (sol.fun > self.accept).any()
+
+    def root(
+        self,
+        func,
+        x0,
+        guess: Optional[np.ndarray] = None,
+        guess_jac: Optional[np.ndarray] = None,
+        args: tuple = (),
+        jac=None,
+        tol: Optional[float] = None,
+    ) -> optimize.OptimizeResult:
+        """Root of `func` from `guess`, and from `x0` if it is not accepted
+
+        Without the Jacobian function `jac`, the Newton iterations from `guess`
+        are those of Broyden's method from `guess_jac`, the Jacobian at
+        `guess`. `nfev` and `njev` of the result count the evaluations of all
+        the attempts and `nit` their iterations, those of MINPACK being its
+        Jacobian evaluations. `jac` is the approximate Jacobian at the solution.
+        """
+        counts = {"nfev": 0, "njev": 0, "nit": 0}
+        tol = tol if self.tol is None else self.tol
+
+        def fun(x, *args):
+            counts["nfev"] += 1
+            return func(x, *args)
+
+        def counted_jac(x, *args):
+            counts["njev"] += 1
+            return jac(x, *args)
+
+        fun_jac = counted_jac if callable(jac) else None
+        sol = None
+        newton_jac = fun_jac or guess_jac
+        if guess is not None and self.warm_newton and newton_jac is not None:
+            sol = _newton(
+                fun, guess, newton_jac, args, tol=self.tol, accept=self.accept
+            )
+            counts["nit"] += sol.nit
+            if not sol.success:
+                sol = None
+        if sol is None and guess is not None:
+            sol = self._solve(fun, guess, args, fun_jac, tol, counts, capped=True)
+            if not self.accepted(sol):
+                sol = None
+        if sol is None:
+            sol = self._solve(fun, x0, args, fun_jac, tol, counts, capped=False)
+
+        if sol.get("jac") is None:
+            if fun_jac is not None:
+                sol.jac = np.atleast_2d(fun_jac(sol.x, *args))
+            else:
+                sol.jac = forward_difference(lambda x: fun(x, *args), sol.x, sol.fun)
+        sol.update(counts)
+        return sol
+
+    def _solve(self, fun, x, args, jac, tol, counts, capped):
+        """Attempt of the method from `x`, with few evaluations if `capped`"""
+        if self.method in ("newton", "lite"):
+            max_iter = newton_max_iter if capped else line_search_max_iter
+            sol = _newton(
+                fun,
+                x,
+                jac,
+                args,
+                max_iter,
+                tol,
+                self.accept,
+                line_search=self.method == "newton",
+            )
+            sol.setdefault("fun", np.full(np.size(x), math.inf))
+        elif self.method in ("hybr", "lm"):
+            options = {}
+            if capped:
+                maxfev = guess_maxfev * (np.size(x) + 1)
+                options["maxfev" if self.method == "hybr" else "maxiter"] = maxfev
+            sol = optimize.root(fun, x, args, self.method, jac, tol, options=options)
+            sol.jac = _hybr_jac(sol) if self.method == "hybr" else None
+            sol.nit = sol.get("njev", 0)
+        else:
+            sol = self._solve_preconditioned(fun, x, args, jac, tol, capped)
+        counts["nit"] += sol.get("nit", 0)
+        return sol
+
+    def _solve_preconditioned(self, fun, x, args, jac, tol, capped):
+        """Attempt of the quasi-Newton methods of SciPy on the chord steps
+
+        The methods start from a multiple of the identity, whereas the
+        unknowns of the stages have different units. They solve for the steps
+        of Newton's method with the Jacobian at `x`, relative to `x`, instead.
+        """
+        x = np.array(x, dtype=float).reshape(-1)
+        f0 = np.atleast_1d(fun(x, *args))
+        if not np.isfinite(f0).all() or (abs(f0) >= sentinel_residual).any():
+            # Sentinel residuals of the stages
+            return optimize.OptimizeResult(x=x, fun=f0, success=False, nit=0)
+        if jac is None:
+            J = forward_difference(lambda y: fun(y, *args), x, f0)
+        else:
+            J = np.atleast_2d(jac(x, *args))
+        try:
+            lu = linalg.lu_factor(J)
+        except (ValueError, linalg.LinAlgError):
+            return optimize.OptimizeResult(x=x, fun=f0, success=False, nit=0)
+        scale = np.where(x != 0, abs(x), 1.0)
+        # The line searches of SciPy have no limit of evaluations
+        max_eval = guess_maxfev * (len(x) + 1) if capped else line_search_max_iter
+        last = {"nfev": 0}
+
+        def chord_step(y):
+            if last["nfev"] == max_eval:
+                raise _EvaluationLimit
+            last["nfev"] += 1
+            last["x"] = y * scale
+            last["fun"] = np.atleast_1d(fun(last["x"], *args))
+            return linalg.lu_solve(lu, last["fun"]) / scale
+
+        options = {
+            "fatol": newton_tol if tol is None else tol,
+            "jac_options": {"alpha": -1.0},
+        }
+        try:
+            with np.errstate(all="ignore"):
+                sol = optimize.root(
+                    chord_step, x / scale, method=self.method, options=options
+                )
+        except _EvaluationLimit:
+            return optimize.OptimizeResult(
+                x=last["x"], fun=last["fun"], success=False, nit=0
+            )
+        sol.x = sol.x * scale
+        if not np.array_equal(last["x"], sol.x):
+            last["nfev"] = 0
+            chord_step(sol.x / scale)
+        sol.update(fun=last["fun"], jac=None)
+        return sol
+
+
+class _EvaluationLimit(Exception):
+    """Too many evaluations in a solve of SciPy"""
+
+
+def root(
+    func,
+    x0,
+    guess: Optional[np.ndarray] = None,
+    guess_jac: Optional[np.ndarray] = None,
+    args: tuple = (),
+    jac=None,
+    tol: Optional[float] = None,
+) -> optimize.OptimizeResult:
+    """`Solver.root` with the "hybr" method"""
+    return Solver().root(func, x0, guess, guess_jac, args, jac, tol)
+
+
+def bracketed_root(
+    func, lo: float, hi: float, f_lo: float, f_hi: float, x0=None, jac=None
+) -> optimize.OptimizeResult:
+    """Root of the scalar `func` between `lo` and `hi`, where its values `f_lo`
+    and `f_hi` have opposite signs
+
+    Newton steps from `x0` with the derivative `jac`, or secant steps without
+    it, are kept in the bracket by bisections, which also replace the steps
+    longer than half the step before the last one. Without `x0`, the first
+    step is the secant of the bracket. `func` and `jac` take arrays of one
+    unknown, as for `root`, and `jac` of the result is the last derivative.
+    A value of `func` that is not below `sentinel_residual` in magnitude, e.g.
+    at a failed flash, stops the search without success: `func` may not be
+    continuous in the bracket.
+    """
+    if math.copysign(1, f_lo) == math.copysign(1, f_hi):
+        raise ValueError("The root is not bracketed")
+    sign_lo = math.copysign(1, f_lo)
+    x_prev, f_prev = (lo, f_lo) if abs(f_lo) < abs(f_hi) else (hi, f_hi)
+    if x0 is None:
+        x0 = lo - f_lo * (hi - lo) / (f_hi - f_lo)
+    x = float(np.reshape(x0, -1)[0])
+    if not lo < x < hi:
+        x = 0.5 * (lo + hi)
+
+    sol = optimize.OptimizeResult(success=False, nfev=1, nit=0)
+    f = float(np.reshape(func(np.array([x])), -1)[0])
+    slope = math.nan
+    dx = dx_old = hi - lo
+    for _ in range(bracket_max_iter):
+        if not abs(f) < sentinel_residual:
+            break
+        if f == 0:
+            sol.success = True
+            break
+        if math.copysign(1, f) == sign_lo:
+            lo = x
+        else:
+            hi = x
+
+        if jac is not None:
+            slope = float(np.reshape(jac(np.array([x])), -1)[0])
+        else:
+            slope = (f - f_prev) / (x - x_prev)
+        dx_old, dx = dx, f / slope if slope != 0 else math.nan
+        if not lo < x - dx < hi or abs(dx) > 0.5 * abs(dx_old):
+            dx = x - 0.5 * (lo + hi)
+        x_new = x - dx
+
+        f_new = float(np.reshape(func(np.array([x_new])), -1)[0])
+        sol.nfev += 1
+        sol.nit += 1
+        x_prev, f_prev, x, f = x, f, x_new, f_new
+        if abs(dx) <= newton_tol * abs(x) and abs(f) < sentinel_residual:
+            sol.success = True
+            break
+    sol.update(x=np.array([x]), fun=np.array([f]), jac=np.array([[slope]]))
+    return sol
+
+
+def with_jacobian(residual, jacobian):
+    """Residual and Jacobian functions for `root` from a residual with states
+
+    `residual(x)` returns the residuals and the states, e.g. the flashes,
+    from which `jacobian(x, states)` evaluates the Jacobian. The last
+    `kept_evaluations` are kept: the Jacobian reuses their states at `x`, and
+    `fun.states(x)` returns them, e.g. at the solution for the outputs of a
+    stage, evaluating the residual only if `x` is not among them. States are
+    None where the residual failed, the Jacobian is then a forward difference.
+    The Jacobian function is None if `analytic_jacobians` is False.
+    """
+    fun = _KeptResidual(residual, jacobian)
+    return fun, fun.jac if analytic_jacobians else None
+
+
+class _KeptResidual:
+    """Residual of `with_jacobian` and its kept evaluations
+
+    A class rather than closures, which would hold each other in a reference
+    cycle: the evaluations and their states are then freed with the solve
+    instead of by the garbage collector.
+    """
+
+    __slots__ = ("residual", "jacobian", "kept")
+
+    def __init__(self, residual, jacobian):
+        self.residual = residual
+        self.jacobian = jacobian
+        self.kept = deque(maxlen=kept_evaluations)
+
+    def __call__(self, x):
+        err, states = self.residual(x)
+        self.kept.append((np.array(x, dtype=float), err, states))
+        return err
+
+    def evaluation(self, x) -> tuple:
+        """Kept evaluation at `x`, evaluated if there is none"""
+        for evaluation in reversed(self.kept):
+            if np.array_equal(evaluation[0], x):
+                return evaluation
+        self(x)
+        return self.kept[-1]
+
+    def states(self, x):
+        """States of the residual at `x`"""
+        return self.evaluation(x)[2]
+
+    def jac(self, x):
+        _, err, states = self.evaluation(x)
+        if states is None:
+            return forward_difference(self, x, err)
+        return np.atleast_2d(self.jacobian(x, states))
+
+
+def forward_difference(func, x, f0) -> np.ndarray:
+    """Jacobian of `func` at `x` by forward differences, `f0` is func(x)"""
+    x = np.array(x, dtype=float).reshape(-1)
+    f0 = np.atleast_1d(f0)
+    jac = np.empty((len(f0), len(x)))
+    for j in range(len(x)):
+        h = fd_step * (abs(x[j]) or 1.0)
+        xh = x.copy()
+        xh[j] += h
+        jac[:, j] = (np.atleast_1d(func(xh)) - f0) / h
+    return jac
+
+
+def sub_guess(guess, guess_jac, index: slice):
+    """Part `index` of `guess` and of its block-diagonal Jacobian"""
+    if guess is None:
+        return None, None
+    if guess_jac is None:
+        return guess[index], None
+    return guess[index], guess_jac[index, index]
+
+
+def _newton(
+    func,
+    x,
+    jac,
+    args: tuple,
+    max_iter: int = newton_max_iter,
+    tol: Optional[float] = None,
+    accept: float = 0.001,
+    line_search: bool = False,
+) -> optimize.OptimizeResult:
+    """Newton iterations with the Jacobian function `jac`, or forward
+    differences if it is None, or quasi-Newton iterations from the Jacobian
+    matrix `jac` with Broyden updates
+
+    Without `line_search`, the iterations are abandoned when the largest
+    residual increases. With it, the steps are halved until the squared
+    residuals decrease enough, except the last step.
+    """
+    tol = newton_tol if tol is None else tol
+    x = np.array(x, dtype=float, ndmin=1)
+    update = jac is not None and not callable(jac)
+    if update:
+        J = np.array(jac, dtype=float)
+    sol = optimize.OptimizeResult(x=x, success=False, nit=0)
+    fun = np.atleast_1d(func(x, *args))
+    for _ in range(max_iter):
+        if not np.isfinite(fun).all() or (abs(fun) >= sentinel_residual).any():
+            # Sentinel residuals of the stages
+            return sol
+        if jac is None:
+            J = forward_difference(lambda y: func(y, *args), x, fun)
+        elif not update:
+            J = np.atleast_2d(jac(x, *args))
+        try:
+            dx = -np.linalg.solve(J, fun)
+        except np.linalg.LinAlgError:
+            return sol
+        sol.nit += 1
+
+        new_fun = np.atleast_1d(func(x + dx, *args))
+        if line_search and np.max(abs(dx) / abs(x + dx)) > tol:
+            for _ in range(max_halvings):
+                if (
+                    np.isfinite(new_fun).all()
+                    and (abs(new_fun) < sentinel_residual).all()
+                    and new_fun @ new_fun <= (1 - sufficient_decrease) * (fun @ fun)
+                ):
+                    break
+                dx = 0.5 * dx
+                new_fun = np.atleast_1d(func(x + dx, *args))
+            else:
+                return sol
+        x = x + dx
+
+        if np.max(abs(dx) / abs(x)) <= tol:
+            success = not (new_fun > accept).any()
+            sol.update(x=x, fun=new_fun, jac=J, success=success)
+            return sol
+        if not line_search and np.max(abs(new_fun)) > np.max(abs(fun)):
+            # The guess is too far from the solution
+            return sol
+        if update:
+            J += np.outer(new_fun - fun - J @ dx, dx) / (dx @ dx)
+        fun = new_fun
+    return sol
+
+
+def _hybr_jac(sol: optimize.OptimizeResult) -> Optional[np.ndarray]:
+    """Jacobian at the solution from the QR factors of "hybr" """
+    if "r" not in sol:
+        return None
+    n = len(sol.x)
+    r = np.zeros((n, n))
+    r[np.triu_indices(n)] = sol.r
+    return sol.fjac.T @ r
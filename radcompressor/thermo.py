@@ -1,37 +1,151 @@
 __all__ = [
+    "CachedFluid",
     "CoolPropFluid",
     "Fluid",
+    "IdealGasFluid",
+    "PerfectGasFluid",
     "RefpropFluid",
+    "TabularCoolPropFluid",
     "ThermoException",
     "ThermoProp",
+    "ThermoPropArray",
+    "clear_registry",
+    "get_backend",
+    "get_fluid",
+    "max_mass_flux",
+    "static_derivatives",
     "static_from_total",
     "total_from_static",
 ]
 
-from .thermolibs.base import Fluid, ThermoException, ThermoProp
+import math
+from typing import Optional, Tuple
 
-try:
-    from .thermolibs.coolprop import CoolPropFluid
-except ImportError as e:
-    CoolPropFluid = None
+from scipy.optimize import OptimizeResult
 
-try:
-    from .thermolibs.refprop import RefpropFluid
-except (ImportError, KeyError) as e:
-    RefpropFluid = None
+from .solvers import bracketed_root
+from .thermolibs import get_backend
+from .thermolibs.base import (
+    Fluid,
+    ThermoException,
+    ThermoProp,
+    ThermoPropArray,
+    clear_registry,
+    get_fluid,
+)
+from .thermolibs.cache import CachedFluid
 
+# Fractions of the sonic speed where `max_mass_flux` checks that the mass flux
+# is below that of the sonic point
+sonic_check_fractions = (0.25, 0.5, 0.75)
 
-if CoolPropFluid is None and RefpropFluid is None:
-    raise ImportError(
-        "No thermodynamic library available. Install CoolProp or Refprop."
-    )
+# Phase hint of the "PH" and "PS" flashes of the impeller and diffuser, None
+# as the gas-hinted CoolProp flash is slower than the unhinted one on the
+# grids of `benchmark.py phase-hint`
+gas_hint = None
+
+# Fluid classes resolved through the backend registry on first access, None if
+# the backend is not available
+_lazy_backends = {
+    "CoolPropFluid": "coolprop",
+    "TabularCoolPropFluid": "tabular",
+    "RefpropFluid": "refprop",
+    "PerfectGasFluid": "perfectgas",
+    "IdealGasFluid": "idealgas",
+}
+
+
+def __getattr__(name: str):
+    if name not in _lazy_backends:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        cls = get_backend(_lazy_backends[name])
+    except ImportError:
+        cls = None
+    globals()[name] = cls
+    return cls
 
 
-def static_from_total(tot: ThermoProp, speed: float) -> ThermoProp:
+def static_from_total(
+    tot: ThermoProp, speed: float, outputs: Optional[str] = None, errors="raise"
+) -> ThermoProp:
     """Get static flow condition based on total condition and flow speed"""
-    return tot.fld.thermo_prop("HS", (tot.H - 0.5 * speed**2), tot.S)
+    return tot.fld.thermo_prop_isentropic(
+        tot, tot.H - 0.5 * speed**2, outputs, errors
+    )
 
 
-def total_from_static(stat: ThermoProp, speed: float) -> ThermoProp:
+def total_from_static(
+    stat: ThermoProp, speed: float, outputs: Optional[str] = None, errors="raise"
+) -> ThermoProp:
     """Get total flow condition based on static condition and flow speed"""
-    return stat.fld.thermo_prop("HS", (stat.H + 0.5 * speed**2), stat.S)
+    return stat.fld.thermo_prop_isentropic(
+        stat, stat.H + 0.5 * speed**2, outputs, errors
+    )
+
+
+def static_derivatives(
+    tot: ThermoProp, stat: ThermoProp, speed: float
+) -> Tuple[float, float, float]:
+    """Derivatives of the static density with respect to the flow speed, and
+    to the pressure and enthalpy of the total condition
+
+    `stat` is the static condition of `tot` at `speed`. The static enthalpy
+    is tot.H - speed**2 / 2 and the entropy changes with the total pressure
+    by -1 / (tot.D * tot.T), and with the total enthalpy by 1 / tot.T.
+    """
+    D_H = stat.derivative("D", "H", "S")
+    D_S = stat.derivative("D", "S", "H")
+    return -speed * D_H, -D_S / (tot.D * tot.T), D_H + D_S / tot.T
+
+
+def max_mass_flux(tot: ThermoProp) -> OptimizeResult:
+    """Largest mass flux of the flow from the total condition `tot`, which is
+    at the sonic point of its isentrope
+
+    `x` of the result is the sonic speed, `static` the static condition there
+    (D and A), `flux` the mass flux and `nfev` the number of flashes. `success`
+    is False if the isentrope fails or enters the two-phase region before the
+    sonic point, or if the mass flux is larger below the sonic point: the mass
+    flux may then have several maxima, e.g. near the critical point.
+    """
+    statics = {}
+
+    def excess(x):
+        """Mach number in excess of one, nan at the states without a sonic
+        point of the single phase"""
+        stat = static_from_total(tot, x[0], outputs="DA", errors="nan")
+        statics[x[0]] = stat
+        if not stat.valid or stat.phase == "twophase":
+            return math.nan
+        return x[0] / stat.A - 1
+
+    # From the sonic speed of a perfect gas with the isentropic exponent of tot
+    k = tot.A**2 * tot.D / tot.P
+    lo, f_lo, hi = 0.0, -1.0, tot.A * (2 / (k + 1)) ** 0.5
+    f_hi = excess([hi])
+    nfev = 1
+    while f_hi < 0:
+        lo, f_lo, hi = hi, f_hi, 1.2 * hi
+        f_hi = excess([hi])
+        nfev += 1
+    if math.isnan(f_hi):
+        return OptimizeResult(success=False, nfev=nfev, nit=0)
+
+    sol = bracketed_root(excess, lo, hi, f_lo, f_hi)
+    nfev += sol.nfev
+    if not sol.success:
+        return OptimizeResult(success=False, nfev=nfev, nit=sol.nit)
+    c = sol.x[0]
+    flux = c * statics[c].D
+
+    # The mass flux increases up to the sonic point
+    for frac in sonic_check_fractions:
+        stat = static_from_total(tot, frac * c, outputs="D", errors="nan")
+        statics[frac * c] = stat
+        nfev += 1
+    for speed, stat in statics.items():
+        if speed < c and not (stat.valid and speed * stat.D < flux):
+            return OptimizeResult(success=False, nfev=nfev, nit=sol.nit)
+    sol.update(static=statics[c], flux=flux, nfev=nfev)
+    return sol
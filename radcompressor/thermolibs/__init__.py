@@ -0,0 +1,80 @@
+"""Registry of the thermodynamic backends
+
+Backends are imported on first use, so that importing `radcompressor` does not
+load CoolProp or REFPROP. Other packages can provide backends through the
+"radcompressor.backends" entry point group, e.g.
+
+    [project.entry-points."radcompressor.backends"]
+    mybackend = "mypackage.thermo:MyFluid"
+"""
+__all__ = ["backends", "get_backend", "register_backend"]
+
+import importlib
+import threading
+from typing import Dict, Type
+
+# Backend name -> "module:attribute", relative modules are in this package
+backends: Dict[str, str] = {
+    "coolprop": ".coolprop:CoolPropFluid",
+    "tabular": ".tabular:TabularCoolPropFluid",
+    "refprop": ".refprop:RefpropFluid",
+    "perfectgas": ".perfectgas:PerfectGasFluid",
+    "idealgas": ".perfectgas:IdealGasFluid",
+}
+
+entry_point_group = "radcompressor.backends"
+
+_loaded: Dict[str, type] = {}
+_lock = threading.Lock()
+_entry_points_loaded = False
+
+
+def register_backend(name: str, target: str):
+    """Register the fluid class `target` ("module:attribute") as `name`"""
+    backends[name] = target
+    _loaded.pop(name, None)
+
+
+def get_backend(name: str) -> Type:
+    """Fluid class of the backend `name`, imported on first use
+
+    Raises ImportError if the backend cannot be loaded, e.g. when CoolProp is
+    not installed or REFPROP is not configured.
+    """
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in backends:
+            _load_entry_points()
+        if name not in backends:
+            raise ValueError(
+                f"Unknown backend {name}, available: {', '.join(backends)}"
+            )
+        module, _, attr = backends[name].partition(":")
+        try:
+            cls = getattr(importlib.import_module(module, __name__), attr)
+        except KeyError as e:
+            # REFPROP without RPPREFIX/RPLIBRARY
+            raise ImportError(f"Backend {name} is not configured: {e}") from e
+        _loaded[name] = cls
+        return cls
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    # importlib.metadata is slow to import
+    from importlib import metadata
+
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=entry_point_group)
+    else:
+        # Python < 3.10
+        eps = eps.get(entry_point_group, [])
+    for ep in eps:
+        backends.setdefault(ep.name, ep.value)
@@ -1,7 +1,37 @@
-__all__ = ["Fluid", "ThermoException", "ThermoProp"]
+__all__ = [
+    "Fluid",
+    "ThermoException",
+    "ThermoProp",
+    "ThermoPropArray",
+    "clear_registry",
+    "get_fluid",
+    "phases",
+]
 
-from dataclasses import dataclass, field
-from math import nan
+import inspect
+import threading
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from math import isnan, nan
+from typing import Optional, Type
+
+import numpy as np
+
+# Phases accepted by the backends, the position in the tuple is the phase code
+# used in `ThermoPropArray`
+phases = ("gas", "twophase", "supercritical", "supercritical_gas")
+
+# Properties of the flashes, which are all evaluated when `outputs` is None
+properties = "PTDHSAV"
+
+# Input pairs of the flashes of all the backends, and relative step of the
+# finite differences of `Fluid.partial_derivative`
+flash_inputs = ("PT", "PH", "PS", "HS")
+derivative_step = 1e-6
+
+# Process-wide fluid instances, keyed by class and constructor arguments. They
+# are kept until `clear_registry`, e.g. to free the memory of a cache.
+_registry = {}
+_registry_lock = threading.RLock()
 
 
 class ThermoException(Exception):
@@ -9,14 +39,168 @@ class ThermoException(Exception):
 
 
 class Fluid:
-    """Abstract base class for fluids"""
+    """Abstract base class for fluids
+
+    The `outputs` argument of the flashes lists the properties needed by the
+    caller, e.g. "DV" for the density and the viscosity. Backends may then
+    skip the others, which are left as nan. All properties are evaluated
+    when `outputs` is None.
+
+    The `phase` argument is a hint of the expected phase, e.g. "gas" when
+    the caller knows the state is superheated. Backends may use it to skip
+    the phase determination, but must return the same state as without it.
+
+    With `errors="nan"`, failed flashes return a nan-filled `ThermoProp`,
+    whose `valid` is False, instead of raising a `ThermoException`. This
+    avoids the cost of the exceptions in the residuals of the solvers.
+    """
 
     def activate(self):
         pass
 
-    def thermo_prop(self, in_type: str, in1: float, in2: float) -> "ThermoProp":
+    def __reduce__(self):
+        # Pickled as a reference, resolved to the registered instance with the
+        # same constructor arguments, which is constructed if there is none
+        return _registered_fluid, (type(self), _init_values(self))
+
+    def thermo_prop(
+        self,
+        in_type: str,
+        in1: float,
+        in2: float,
+        outputs: Optional[str] = None,
+        phase: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
         return ThermoProp(fld=self)
 
+    def thermo_prop_isentropic(
+        self,
+        ref: "ThermoProp",
+        H: float,
+        outputs: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        """State with the entropy of `ref` and the enthalpy `H`
+
+        Backends may override it with a faster method that starts from `ref`,
+        it is used to convert between static and total conditions.
+        """
+        return self.thermo_prop("HS", H, ref.S, outputs, errors=errors)
+
+    def thermo_prop_batch(
+        self, in_type: str, in1, in2, outputs: Optional[str] = None
+    ) -> "ThermoPropArray":
+        """Flash many states at once, `in1` and `in2` are broadcast together
+
+        Failed flashes do not raise but are flagged in `ThermoPropArray.valid`.
+        """
+        in1, in2 = np.broadcast_arrays(np.asarray(in1, float), np.asarray(in2, float))
+        out = ThermoPropArray.empty(in1.shape, self)
+        for i, (v1, v2) in enumerate(zip(in1.flat, in2.flat)):
+            tp = self.thermo_prop(in_type, v1, v2, outputs, errors="nan")
+            if tp.valid:
+                out.set(i, tp)
+        return out
+
+    def partial_derivative(
+        self, tp: "ThermoProp", of: str, wrt: str, constant: str
+    ) -> float:
+        """Derivative of `of` with respect to `wrt` at constant `constant`
+
+        The properties are named as the fields of `ThermoProp`, e.g.
+        ("D", "S", "H") for the derivative of the density with respect to the
+        entropy at constant enthalpy, at the state `tp`. The default is a
+        central difference of the flashes with `wrt` and `constant` as inputs,
+        backends may override it with the derivatives of the equation of state.
+        """
+        for in_type in (wrt + constant, constant + wrt):
+            if in_type in flash_inputs:
+                break
+        else:
+            raise ValueError(f"No flash with {wrt} and {constant} as inputs")
+        x = getattr(tp, wrt)
+        step = derivative_step * max(abs(x), 1.0)
+        values = []
+        for dx in (-step, step):
+            inputs = {wrt: x + dx, constant: getattr(tp, constant)}
+            out = self.thermo_prop(in_type, inputs[in_type[0]], inputs[in_type[1]])
+            values.append(getattr(out, of))
+        return (values[1] - values[0]) / (2 * step)
+
+    def with_outputs(
+        self, tp: "ThermoProp", outputs: Optional[str] = None
+    ) -> "ThermoProp":
+        """The state `tp` with the properties of `outputs`, all if None, that
+        its flash skipped
+
+        The other properties of `tp` are kept. The default is a "PH" flash,
+        backends may override it with the equation of state at `tp`.
+        """
+        missing = _missing(tp, outputs)
+        if not missing:
+            return tp
+        full = self.thermo_prop("PH", tp.P, tp.H, missing)
+        return replace(tp, **{k: getattr(full, k) for k in missing})
+
+    def _failed(self, errors: str, *args) -> "ThermoProp":
+        """Outcome of a failed flash, depending on `errors`"""
+        if errors == "nan":
+            return ThermoProp(fld=self)
+        raise ThermoException(*args)
+
+
+def get_fluid(cls: Type[Fluid], *args, **kwargs) -> Fluid:
+    """Shared instance of `cls(*args, **kwargs)`, constructed once per process"""
+    bound = inspect.signature(cls).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return _registered_fluid(cls, tuple(bound.arguments.values()))
+
+
+def clear_registry():
+    """Drop the shared instances of `get_fluid` and of unpickling, which are
+    constructed again when next needed"""
+    with _registry_lock:
+        _registry.clear()
+
+
+def _registered_fluid(cls: Type[Fluid], values: tuple) -> Fluid:
+    key = (cls, _hashable(values))
+    fld = _registry.get(key)
+    if fld is not None:
+        return fld
+    with _registry_lock:
+        # Another thread may have constructed it in the meantime
+        fld = _registry.get(key)
+        if fld is None:
+            fld = cls(*values)
+            _registry[key] = fld
+            # Also register the values after __post_init__ (used by pickle)
+            _registry.setdefault((cls, _hashable(_init_values(fld))), fld)
+        return fld
+
+
+def _missing(tp: "ThermoProp", outputs: Optional[str]) -> str:
+    """Properties of `outputs`, all if None, that are nan in `tp`"""
+    return "".join(k for k in outputs or properties if isnan(getattr(tp, k)))
+
+
+def _init_values(fld: Fluid) -> tuple:
+    """Values of the constructor arguments of `fld`"""
+    if not is_dataclass(fld):
+        return ()
+    return tuple(getattr(fld, f.name) for f in fields(fld) if f.init)
+
+
+def _hashable(value):
+    if isinstance(value, Fluid):
+        return (type(value), _hashable(_init_values(value)))
+    if isinstance(value, np.ndarray):
+        return _hashable(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
 
 @dataclass(frozen=True)
 class ThermoProp:
@@ -31,3 +215,62 @@ class ThermoProp:
     V: float = nan
     phase: str = ""
     fld: Fluid = field(default_factory=Fluid)
+
+    @property
+    def valid(self) -> bool:
+        """False for the result of a failed flash"""
+        return self.phase != ""
+
+    def derivative(self, of: str, wrt: str, constant: str) -> float:
+        """Partial derivative at this state, see `Fluid.partial_derivative`"""
+        return self.fld.partial_derivative(self, of, wrt, constant)
+
+    def with_outputs(self, outputs: Optional[str] = None) -> "ThermoProp":
+        """This state with the properties skipped by its flash, see
+        `Fluid.with_outputs`"""
+        return self.fld.with_outputs(self, outputs)
+
+
+@dataclass(frozen=True)
+class ThermoPropArray:
+    """Thermodynamic properties of many states, stored as columns
+
+    `phase` holds the index of the phase in `phases`, or -1 if the flash
+    failed, in which case the other properties are nan.
+    """
+
+    P: np.ndarray
+    T: np.ndarray
+    D: np.ndarray
+    H: np.ndarray
+    S: np.ndarray
+    A: np.ndarray
+    V: np.ndarray
+    phase: np.ndarray
+    fld: Fluid = field(default_factory=Fluid)
+
+    @classmethod
+    def empty(cls, shape, fld: Fluid) -> "ThermoPropArray":
+        """Array of failed states"""
+        columns = {k: np.full(shape, nan) for k in "PTDHSAV"}
+        return cls(phase=np.full(shape, -1, dtype=np.int8), fld=fld, **columns)
+
+    @property
+    def valid(self) -> np.ndarray:
+        """Mask of the successful flashes"""
+        return self.phase >= 0
+
+    def __len__(self) -> int:
+        return len(self.P)
+
+    def __getitem__(self, i) -> ThermoProp:
+        if self.phase[i] < 0:
+            raise ThermoException("Failed flash")
+        d = {k: float(getattr(self, k)[i]) for k in "PTDHSAV"}
+        return ThermoProp(phase=phases[self.phase[i]], fld=self.fld, **d)
+
+    def set(self, i: int, tp: ThermoProp):
+        """Store `tp` at flat index `i`"""
+        for k in "PTDHSAV":
+            getattr(self, k).flat[i] = getattr(tp, k)
+        self.phase.flat[i] = phases.index(tp.phase)
@@ -0,0 +1,172 @@
+"""Memoization layer for fluids
+
+`CachedFluid` wraps any `Fluid` and keeps the most recently used flashes in
+a bounded LRU cache. The returned `ThermoProp` refer to the wrapper, so that
+chained flashes (e.g. `static_from_total`) also go through the cache.
+"""
+__all__ = ["CacheInfo", "CachedFluid"]
+
+import math
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import NamedTuple, Optional
+
+from .base import Fluid, ThermoException, ThermoProp
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+    nbytes: int
+
+
+def _quantize(value: float, rtol: float):
+    """Round `value` to a relative tolerance of about `rtol`"""
+    if rtol <= 0 or value == 0 or not math.isfinite(value):
+        return value
+    mantissa, exponent = math.frexp(value)
+    return exponent, round(mantissa / rtol)
+
+
+@dataclass
+class CachedFluid(Fluid):
+    """LRU cache of the flashes of `fluid`
+
+    Inputs are quantized to the relative tolerance `rtol` (0 means exact
+    inputs) before the lookup. The cache holds at most `maxsize` flashes and,
+    if `max_bytes` is given, approximately at most `max_bytes` of memory.
+    Failed flashes are cached as well and raise the same `ThermoException`.
+    """
+
+    fluid: Fluid
+    maxsize: int = 65536
+    rtol: float = 0.0
+    max_bytes: Optional[int] = None
+
+    def __post_init__(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._entry_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # Fluid attributes (name, P_crit, T_triple, ...) of the wrapped fluid
+        if name.startswith("__") or name == "fluid":
+            raise AttributeError(name)
+        return getattr(self.fluid, name)
+
+    def activate(self):
+        self.fluid.activate()
+
+    def thermo_prop(
+        self,
+        in_type,
+        in1: float,
+        in2: float,
+        outputs: Optional[str] = None,
+        phase: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        # The phase hint does not change the result, it is not part of the key
+        key = (
+            in_type,
+            _quantize(in1, self.rtol),
+            _quantize(in2, self.rtol),
+            outputs,
+        )
+        return self._lookup(
+            key,
+            lambda: self.fluid.thermo_prop(in_type, in1, in2, outputs, phase, errors),
+            errors,
+        )
+
+    def thermo_prop_isentropic(
+        self,
+        ref: ThermoProp,
+        H: float,
+        outputs: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        # Shares the entries of the "HS" flashes
+        key = ("HS", _quantize(H, self.rtol), _quantize(ref.S, self.rtol), outputs)
+        return self._lookup(
+            key,
+            lambda: self.fluid.thermo_prop_isentropic(ref, H, outputs, errors),
+            errors,
+        )
+
+    def partial_derivative(
+        self, tp: ThermoProp, of: str, wrt: str, constant: str
+    ) -> float:
+        # Derivatives of the wrapped fluid, they are not cached
+        return self.fluid.partial_derivative(tp, of, wrt, constant)
+
+    def with_outputs(self, tp: ThermoProp, outputs: Optional[str] = None) -> ThermoProp:
+        return self.fluid.with_outputs(tp, outputs)
+
+    def _lookup(self, key, flash, errors) -> "ThermoProp":
+        # Failed flashes are stored either as the exception or as the nan
+        # result, depending on the `errors` of the first call
+        # The flash itself runs outside of the lock
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+        if isinstance(value, ThermoException):
+            if errors == "nan":
+                return ThermoProp(fld=self)
+            raise value.with_traceback(None)
+        if value is not None:
+            if not value.valid:
+                return self._failed(errors, "Failed flash", *key)
+            return value
+
+        try:
+            tp = flash()
+            value = replace(tp, fld=self)
+        except ThermoException as e:
+            value = e
+        with self._lock:
+            self._insert(key, value)
+        if isinstance(value, ThermoException):
+            raise value
+        return value
+
+    def _insert(self, key, value):
+        if not self._entry_bytes:
+            self._entry_bytes = _entry_size(key, value)
+        maxsize = self.maxsize
+        if self.max_bytes is not None:
+            maxsize = min(maxsize, self.max_bytes // self._entry_bytes)
+        self._cache[key] = value
+        while len(self._cache) > maxsize:
+            self._cache.popitem(last=False)
+
+    def cache_info(self) -> CacheInfo:
+        """Hit and miss counters, and current size of the cache"""
+        n = len(self._cache)
+        return CacheInfo(self.hits, self.misses, self.maxsize, n, n * self._entry_bytes)
+
+    def cache_clear(self):
+        """Empty the cache and reset the counters"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _entry_size(key, value) -> int:
+    """Approximate memory footprint of a cache entry"""
+    size = sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key)
+    size += sys.getsizeof(value) + sys.getsizeof(value.__dict__)
+    size += sum(sys.getsizeof(v) for v in value.__dict__.values())
+    # OrderedDict links
+    return size + 100
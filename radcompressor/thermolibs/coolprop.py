@@ -1,12 +1,22 @@
 """Set of functions and classes to use CoolProp as backend"""
-__all__ = ["CoolPropFluid"]
+__all__ = ["CoolPropFluid", "PhaseHintInfo"]
 
-from dataclasses import dataclass
-from typing import Union
+import threading
+from dataclasses import dataclass, replace
+from math import nan
+from typing import NamedTuple, Optional, Union
 
 import CoolProp as CP
+import numpy as np
 
-from .base import Fluid, ThermoException, ThermoProp
+from .base import (
+    Fluid,
+    ThermoException,
+    ThermoProp,
+    ThermoPropArray,
+    _missing,
+    phases,
+)
 
 
 cp_inputs = {
@@ -27,6 +37,23 @@ cp_phases = {
     CP.iphase_supercritical: "supercritical",
     CP.iphase_supercritical_gas: "supercritical_gas",
 }
+cp_phase_codes = {k: phases.index(v) for k, v in cp_phases.items()}
+
+# Newton iteration of the isentropic flash, tolerances on h (J/kg) and s (J/kg/K)
+isentropic_max_iter = 20
+isentropic_tol = (1e-6, 1e-9)
+
+# Newton iteration of the gas-hinted "PH" and "PS" flashes, relative tolerance
+# on T, and relative margin to the saturation temperature given by the
+# ancillary below which the unhinted flash is used
+hint_max_iter = 30
+hint_tol = 1e-10
+hint_sat_margin = 1e-3
+
+
+class PhaseHintInfo(NamedTuple):
+    hinted: int
+    fallbacks: int
 
 
 @dataclass
@@ -34,7 +61,24 @@ class CoolPropFluid(Fluid):
     name: str
 
     def __post_init__(self):
-        self.state = CP.AbstractState("HEOS", self.name.upper())
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hinted = 0
+        self.fallbacks = 0
+        # Fails early on unknown fluids, the critical point is read once as
+        # the hinted flashes check it every time
+        state = self.state
+        self._P_crit = state.p_critical()
+        self._T_crit = state.T_critical()
+
+    @property
+    def state(self) -> CP.AbstractState:
+        """AbstractState of the calling thread"""
+        try:
+            return self._local.state
+        except AttributeError:
+            self._local.state = CP.AbstractState("HEOS", self.name.upper())
+            return self._local.state
 
     @property
     def P_max(self) -> float:
@@ -46,11 +90,11 @@ class CoolPropFluid(Fluid):
 
     @property
     def P_crit(self) -> float:
-        return self.state.p_critical()
+        return self._P_crit
 
     @property
     def T_crit(self) -> float:
-        return self.state.T_critical()
+        return self._T_crit
 
     @property
     def P_triple(self) -> float:
@@ -61,8 +105,22 @@ class CoolPropFluid(Fluid):
         return self.state.Ttriple()
 
     def thermo_prop(
-        self, in_type: Union[str, int], in1: float, in2: float
+        self,
+        in_type: Union[str, int],
+        in1: float,
+        in2: float,
+        outputs: Optional[str] = None,
+        phase: Optional[str] = None,
+        errors: str = "raise",
     ) -> "ThermoProp":
+        if phase == "gas" and in_type in ("PH", "PS"):
+            tp = self._hinted_gas_prop(in_type, in1, in2, outputs)
+            with self._lock:
+                self.hinted += 1
+                self.fallbacks += tp is None
+            if tp is not None:
+                return tp
+
         if isinstance(in_type, str):
             inputs = cp_inputs[in_type]
             input_pair = CP.CoolProp.generate_update_pair(
@@ -71,25 +129,212 @@ class CoolPropFluid(Fluid):
         else:
             input_pair = (in_type, in1, in2)
 
+        state = self.state
         try:
-            self.state.update(*input_pair)
+            state.update(*input_pair)
         except ValueError as e:
-            raise ThermoException(*e.args, *input_pair)
+            return self._failed(errors, *e.args, *input_pair)
+
+        return self._state_prop(state, outputs, errors=errors)
+
+    def thermo_prop_isentropic(
+        self,
+        ref: ThermoProp,
+        H: float,
+        outputs: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        """Newton iteration on (T, D) along the isentrope, starting from `ref`
+
+        Falls back to the "HS" flash in two-phase or if Newton fails.
+        """
+        state = self.state
+        S = ref.S
+        T, D = ref.T, ref.D
+        if ref.phase != "twophase":
+            try:
+                for _ in range(isentropic_max_iter):
+                    state.update(CP.DmassT_INPUTS, D, T)
+                    if state.phase() == CP.iphase_twophase:
+                        break
+                    dh = state.hmass() - H
+                    ds = state.smass() - S
+                    if abs(dh) < isentropic_tol[0] and abs(ds) < isentropic_tol[1]:
+                        return self._state_prop(state, outputs, errors=errors)
+                    h_T = state.first_partial_deriv(CP.iHmass, CP.iT, CP.iDmass)
+                    h_D = state.first_partial_deriv(CP.iHmass, CP.iDmass, CP.iT)
+                    s_T = state.first_partial_deriv(CP.iSmass, CP.iT, CP.iDmass)
+                    s_D = state.first_partial_deriv(CP.iSmass, CP.iDmass, CP.iT)
+                    det = h_T * s_D - h_D * s_T
+                    dT = (s_D * dh - h_D * ds) / det
+                    dD = (h_T * ds - s_T * dh) / det
+                    # Keep T and D positive
+                    while dT >= T or dD >= D:
+                        dT, dD = 0.5 * dT, 0.5 * dD
+                    T, D = T - dT, D - dD
+            except (ValueError, ZeroDivisionError):
+                pass
+        return self.thermo_prop("HS", H, S, outputs, errors=errors)
+
+    def partial_derivative(
+        self, tp: ThermoProp, of: str, wrt: str, constant: str
+    ) -> float:
+        """First partial derivative of the EOS at the density and temperature
+        of `tp`, finite differences where CoolProp does not provide it"""
+        state = self.state
+        try:
+            state.update(CP.DmassT_INPUTS, tp.D, tp.T)
+            return state.first_partial_deriv(
+                cp_outputs[of], cp_outputs[wrt], cp_outputs[constant]
+            )
+        except ValueError:
+            return super().partial_derivative(tp, of, wrt, constant)
+
+    def with_outputs(self, tp: ThermoProp, outputs: Optional[str] = None) -> ThermoProp:
+        """The skipped properties at the density and temperature of `tp`, which
+        avoids a flash"""
+        missing = _missing(tp, outputs)
+        if not missing:
+            return tp
+        state = self.state
+        try:
+            state.update(CP.DmassT_INPUTS, tp.D, tp.T)
+        except ValueError:
+            return super().with_outputs(tp, outputs)
+        full = self._state_prop(state, missing)
+        return replace(tp, **{k: getattr(full, k) for k in missing})
+
+    def _hinted_gas_prop(
+        self, in_type: str, P: float, target: float, outputs: Optional[str]
+    ) -> Optional["ThermoProp"]:
+        """Gas state at pressure `P`, None if it is not clearly in the gas
+
+        Newton iteration on T with "PT" flashes in the imposed gas phase,
+        which skips the phase determination of CoolProp. The iteration starts
+        from the saturation temperature given by the ancillary equation and
+        states close to it are left to the unhinted flash.
+        """
+        state = self.state
+        if not 0 < P < self._P_crit:
+            return None
+        try:
+            T_sat = state.saturation_ancillary(CP.iT, 1, CP.iP, P)
+            T_min = T_sat * (1 + hint_sat_margin)
+            T = T_min
+            state.specify_phase(CP.iphase_gas)
+            for i in range(hint_max_iter):
+                state.update(CP.PT_INPUTS, P, T)
+                if in_type == "PH":
+                    dT = (target - state.hmass()) / state.cpmass()
+                else:
+                    dT = (target - state.smass()) * T / state.cpmass()
+                if i == 0 and dT < 0:
+                    # Below the margin or in the two-phase region
+                    return None
+                T = max(T + dT, 0.5 * (T + T_min))
+                if abs(dT) < hint_tol * T:
+                    break
+            else:
+                return None
+            state.update(CP.PT_INPUTS, P, T)
+        except ValueError:
+            return None
+        finally:
+            state.unspecify_phase()
+
+        if T < self._T_crit:
+            return self._state_prop(state, outputs, CP.iphase_gas)
+        return self._state_prop(state, outputs, CP.iphase_supercritical_gas)
 
-        if self.state.phase() not in cp_phases.keys():
-            raise ThermoException("Not gas or two-phase")
+    def phase_hint_info(self) -> PhaseHintInfo:
+        """Number of hinted flashes, and of those that used the unhinted flash"""
+        return PhaseHintInfo(self.hinted, self.fallbacks)
 
-        d = {k: self.state.keyed_output(v) for k, v in cp_outputs.items()}
-        d["phase"] = cp_phases[self.state.phase()]
-        if self.state.phase() == CP.iphase_twophase:
-            d["A"] = self.state.saturated_vapor_keyed_output(CP.ispeed_sound)
-            d["V"] = self.state.saturated_vapor_keyed_output(CP.iviscosity)
+    def _state_prop(
+        self,
+        state: CP.AbstractState,
+        outputs: Optional[str],
+        phase: Optional[int] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        """Properties of the current `state`, passed by position: this runs for
+        every flash"""
+        if phase is None:
+            phase = state.phase()
+        if phase not in cp_phases:
+            return self._failed(errors, "Not gas or two-phase")
+
+        if phase == CP.iphase_twophase:
+            output = state.saturated_vapor_keyed_output
+        else:
+            output = state.keyed_output
+        A = output(CP.ispeed_sound) if outputs is None or "A" in outputs else nan
+        V = output(CP.iviscosity) if outputs is None or "V" in outputs else nan
+        return ThermoProp(
+            state.p(),
+            state.T(),
+            state.rhomass(),
+            state.hmass(),
+            state.smass(),
+            A,
+            V,
+            cp_phases[phase],
+            self,
+        )
+
+    def thermo_prop_batch(
+        self,
+        in_type: Union[str, int],
+        in1,
+        in2,
+        outputs: Optional[str] = None,
+    ) -> "ThermoPropArray":
+        in1, in2 = np.broadcast_arrays(np.asarray(in1, float), np.asarray(in2, float))
+        out = ThermoPropArray.empty(in1.shape, self)
+        if isinstance(in_type, str):
+            inputs = cp_inputs[in_type]
+            pair, v1, _ = CP.CoolProp.generate_update_pair(
+                inputs[0], 1.0, inputs[1], 2.0
+            )
+            if v1 != 1.0:
+                in1, in2 = in2, in1
         else:
-            d["A"] = self.state.keyed_output(CP.ispeed_sound)
-            d["V"] = self.state.keyed_output(CP.iviscosity)
-        d["fld"] = self
+            pair = in_type
 
-        return ThermoProp(**d)
+        P, T, D, H, S, A, V, phase = (
+            out.P.reshape(-1),
+            out.T.reshape(-1),
+            out.D.reshape(-1),
+            out.H.reshape(-1),
+            out.S.reshape(-1),
+            out.A.reshape(-1),
+            out.V.reshape(-1),
+            out.phase.reshape(-1),
+        )
+        need_A = outputs is None or "A" in outputs
+        need_V = outputs is None or "V" in outputs
+        state = self.state
+        for i, (v1, v2) in enumerate(zip(in1.flat, in2.flat)):
+            try:
+                state.update(pair, v1, v2)
+            except ValueError:
+                continue
+            code = cp_phase_codes.get(state.phase(), -1)
+            if code < 0:
+                continue
+            phase[i] = code
+            P[i] = state.p()
+            T[i] = state.T()
+            D[i] = state.rhomass()
+            H[i] = state.hmass()
+            S[i] = state.smass()
+            if code == 1:
+                output = state.saturated_vapor_keyed_output
+            else:
+                output = state.keyed_output
+            if need_A:
+                A[i] = output(CP.ispeed_sound)
+            if need_V:
+                V[i] = output(CP.iviscosity)
 
-    def __getstate__(self):
-        return {"name": self.name}
+        return out
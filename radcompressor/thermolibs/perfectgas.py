@@ -0,0 +1,223 @@
+"""Analytic ideal-gas fluids for fast screening
+
+`PerfectGasFluid` has a constant heat capacity and closed-form flashes,
+`IdealGasFluid` has a polynomial heat capacity cp(T) and inverts the
+enthalpy and entropy with a Newton iteration. The viscosity follows
+Sutherland's law. Neither has a two-phase region.
+"""
+__all__ = ["IdealGasFluid", "PerfectGasFluid"]
+
+import math
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .base import Fluid, ThermoProp
+
+
+# Reference pressure of the entropy
+P_ref = 101325.0
+
+# Newton iteration of the ideal gas, relative tolerance on T
+newton_max_iter = 50
+newton_tol = 1e-13
+
+
+@dataclass
+class PerfectGasFluid(Fluid):
+    """Calorically perfect gas with gas constant `R` and heat capacity `cp`
+
+    The viscosity is mu_ref * (T / T_mu)**1.5 * (T_mu + S_mu) / (T + S_mu),
+    the defaults are those of air. The critical and triple points are only
+    used to label the phase like CoolProp and by the sampling scripts,
+    `from_coolprop` takes them from CoolProp.
+    """
+
+    name: str
+    R: float
+    cp: float
+    mu_ref: float = 1.716e-5
+    T_mu: float = 273.15
+    S_mu: float = 110.4
+    P_crit: float = math.inf
+    T_crit: float = 0.0
+    P_triple: float = 0.0
+    T_triple: float = 0.0
+    P_max: float = math.inf
+    T_max: float = math.inf
+
+    @classmethod
+    def from_coolprop(cls, name: str, T_range=(250.0, 1000.0), **kwargs):
+        """Fit the gas constant, cp at T_range[0] and the viscosity on CoolProp"""
+        return cls(name, **{**_coolprop_parameters(name, T_range), **kwargs})
+
+    def thermo_prop(
+        self,
+        in_type: str,
+        in1: float,
+        in2: float,
+        outputs: Optional[str] = None,
+        phase: Optional[str] = None,
+        errors: str = "raise",
+    ) -> "ThermoProp":
+        if in_type == "PT":
+            P, T = in1, in2
+        elif in_type == "PH":
+            P, T = in1, self._T_from_h(in2)
+        elif in_type == "PS":
+            P = in1
+            T = self._T_from_s0(in2 + self.R * math.log(P / P_ref)) if P > 0 else P
+        elif in_type == "HS":
+            T = self._T_from_h(in1)
+            P = P_ref * math.exp((self._s0(T) - in2) / self.R) if T > 0 else T
+        else:
+            return self._failed(errors, f"Input pair {in_type} is not supported")
+
+        # nan if an inversion did not converge
+        if not (P > 0 and T > 0):
+            return self._failed(errors, "Invalid pressure or temperature", in1, in2)
+        return self._prop(P, T)
+
+    def _prop(self, P: float, T: float) -> ThermoProp:
+        cp = self._cp(T)
+        if T < self.T_crit:
+            phase = "gas"
+        elif P < self.P_crit:
+            phase = "supercritical_gas"
+        else:
+            phase = "supercritical"
+        return ThermoProp(
+            P=P,
+            T=T,
+            D=P / (self.R * T),
+            H=self._h(T),
+            S=self._s0(T) - self.R * math.log(P / P_ref),
+            A=math.sqrt(cp / (cp - self.R) * self.R * T),
+            V=self.mu_ref
+            * (T / self.T_mu) ** 1.5
+            * (self.T_mu + self.S_mu)
+            / (T + self.S_mu),
+            phase=phase,
+            fld=self,
+        )
+
+    def _cp(self, T: float) -> float:
+        return self.cp
+
+    def _h(self, T: float) -> float:
+        return self.cp * T
+
+    def _s0(self, T: float) -> float:
+        """Entropy at the reference pressure"""
+        return self.cp * math.log(T)
+
+    def _T_from_h(self, h: float) -> float:
+        return h / self.cp
+
+    def _T_from_s0(self, s0: float) -> float:
+        return math.exp(s0 / self.cp)
+
+
+@dataclass
+class IdealGasFluid(PerfectGasFluid):
+    """Ideal gas with cp(T) = cp + cp_coeffs[0] * T + cp_coeffs[1] * T**2 + ..."""
+
+    cp_coeffs: Tuple[float, ...] = ()
+
+    @classmethod
+    def from_coolprop(
+        cls, name: str, T_range=(250.0, 1000.0), degree: int = 4, **kwargs
+    ):
+        """Fit a polynomial of `degree` on the ideal-gas cp of CoolProp"""
+        params = _coolprop_parameters(name, T_range)
+        import CoolProp as CP
+
+        state = CP.AbstractState("HEOS", name.upper())
+        T = np.linspace(*T_range, 50)
+        cp0 = []
+        for Ti in T:
+            state.update(CP.DmassT_INPUTS, 1e-6, Ti)
+            cp0.append(state.keyed_output(CP.iCp0mass))
+        coeffs = np.polynomial.polynomial.polyfit(T, cp0, degree)
+        params["cp"] = coeffs[0]
+        params["cp_coeffs"] = tuple(coeffs[1:])
+        return cls(name, **{**params, **kwargs})
+
+    def __post_init__(self):
+        # Polynomials of cp, h and of the non-logarithmic part of s0
+        a = (self.cp, *self.cp_coeffs)
+        self._cp_poly = a[::-1]
+        self._h_poly = tuple(ai / (i + 1) for i, ai in enumerate(a))[::-1] + (0.0,)
+        self._s_poly = tuple(ai / i for i, ai in enumerate(a) if i > 0)[::-1] + (0.0,)
+
+    def _cp(self, T: float) -> float:
+        return _horner(self._cp_poly, T)
+
+    def _h(self, T: float) -> float:
+        return _horner(self._h_poly, T)
+
+    def _s0(self, T: float) -> float:
+        return self.cp * math.log(T) + _horner(self._s_poly, T)
+
+    def _T_from_h(self, h: float) -> float:
+        T = h / self._cp(300.0)
+        for _ in range(newton_max_iter):
+            if not T > 0:
+                return T
+            dT = (h - self._h(T)) / self._cp(T)
+            T += dT
+            if abs(dT) < newton_tol * T:
+                return T
+        return math.nan
+
+    def _T_from_s0(self, s0: float) -> float:
+        # Newton iteration on ln(T), ds0 / dln(T) = cp
+        T = 300.0
+        for _ in range(newton_max_iter):
+            dlnT = (s0 - self._s0(T)) / self._cp(T)
+            T *= math.exp(dlnT)
+            if abs(dlnT) < newton_tol:
+                return T
+        return math.nan
+
+
+def _horner(coeffs: Tuple[float, ...], x: float) -> float:
+    """Polynomial with coefficients in decreasing powers of `x`"""
+    y = 0.0
+    for c in coeffs:
+        y = y * x + c
+    return y
+
+
+def _coolprop_parameters(name: str, T_range) -> dict:
+    """Gas constant, Sutherland's law and limits of `name` from CoolProp"""
+    import CoolProp as CP
+
+    state = CP.AbstractState("HEOS", name.upper())
+    R = state.gas_constant() / state.molar_mass()
+
+    # Dilute gas viscosity and heat capacity
+    T1, T2 = T_range
+    mu = []
+    for T in (T1, T2):
+        state.update(CP.DmassT_INPUTS, 1e-6, T)
+        mu.append(state.viscosity())
+    state.update(CP.DmassT_INPUTS, 1e-6, T1)
+    cp = state.keyed_output(CP.iCp0mass)
+    k = mu[1] / mu[0] / (T2 / T1) ** 1.5
+    S_mu = (T1 - k * T2) / (k - 1)
+
+    return dict(
+        R=R,
+        cp=cp,
+        mu_ref=mu[0],
+        T_mu=T1,
+        S_mu=S_mu,
+        P_crit=state.p_critical(),
+        T_crit=state.T_critical(),
+        P_triple=state.keyed_output(CP.iP_triple),
+        T_triple=state.Ttriple(),
+        P_max=state.pmax(),
+        T_max=state.Tmax(),
+    )
@@ -8,7 +8,9 @@ Fluids need to be activate before they can be used.
 __all__ = ["RefpropFluid"]
 
 import os
+import threading
 from dataclasses import dataclass, field
+from typing import Optional
 
 from ctREFPROP.ctREFPROP import REFPROPFunctionLibrary
 
@@ -23,6 +25,11 @@ MASS_BASE_SI = RP.GETENUMdll(0, "MASS BASE SI").iEnum
 
 refprop_phase = {999: "supercritical", 998: "supercritical_gas"}
 
+# REFPROP holds global state, so calls from different threads are serialized
+# and the fluid is loaded again if another one was activated in the meantime
+_lock = threading.RLock()
+_active = None
+
 
 @dataclass
 class RefpropFluid(Fluid):
@@ -35,17 +42,20 @@ class RefpropFluid(Fluid):
     T_triple: float = field(init=False)
 
     def __post_init__(self):
-        r = RP.REFPROPdll(
-            self.name,
-            "",
-            "PMAX;TMAX;Pc;Tc;PTRP;TTRP",
-            MASS_BASE_SI,
-            0,
-            0,
-            0.0,
-            0.0,
-            [1.0],
-        )
+        global _active
+        with _lock:
+            r = RP.REFPROPdll(
+                self.name,
+                "",
+                "PMAX;TMAX;Pc;Tc;PTRP;TTRP",
+                MASS_BASE_SI,
+                0,
+                0,
+                0.0,
+                0.0,
+                [1.0],
+            )
+            _active = self.name
         if r.ierr != 0:
             raise ThermoException(r.herr)
         self.P_max = r.Output[0]
@@ -56,21 +66,38 @@ class RefpropFluid(Fluid):
         self.T_triple = r.Output[5]
 
     def activate(self):
-        RP.SETFLUIDSdll(self.name)
-
-    def thermo_prop(self, in_type, in1, in2):
+        global _active
+        with _lock:
+            RP.SETFLUIDSdll(self.name)
+            _active = self.name
+
+    def thermo_prop(
+        self,
+        in_type,
+        in1,
+        in2,
+        outputs: Optional[str] = None,
+        phase=None,
+        errors: str = "raise",
+    ):
+        with _lock:
+            if _active != self.name:
+                self.activate()
+            return self._thermo_prop(in_type, in1, in2, outputs, errors)
+
+    def _thermo_prop(self, in_type, in1, in2, outputs, errors):
         r = RP.REFPROPdll("", in_type, "P;T;D;H;S", MASS_BASE_SI, 0, 0, in1, in2, [1.0])
 
         if r.ierr != 0:
-            raise ThermoException(r.herr)
+            return self._failed(errors, r.herr)
 
         d = dict(zip(["P", "T", "D", "H", "S"], r.Output))
 
         if r.q >= 0 and r.q < 1:
             d["phase"] = "twophase"
-            r = RP.REFPROPdll("", "PQ", "W;VIS", MASS_BASE_SI, 0, 0, d["P"], 1.0, [1.0])
+            transport_in = ("PQ", d["P"], 1.0)
         elif r.q < 0:
-            raise ThermoException("Liquid")
+            return self._failed(errors, "Liquid")
         else:
             if r.q == 998:
                 d["phase"] = "supercritical_gas"
@@ -78,12 +105,21 @@ class RefpropFluid(Fluid):
                 d["phase"] = "supercritical"
             else:
                 d["phase"] = "gas"
+            transport_in = ("PT", d["P"], d["T"])
+
+        if outputs is None or "A" in outputs or "V" in outputs:
             r = RP.REFPROPdll(
-                "", "PT", "W;VIS", MASS_BASE_SI, 0, 0, d["P"], d["T"], [1.0]
+                "",
+                transport_in[0],
+                "W;VIS",
+                MASS_BASE_SI,
+                0,
+                0,
+                *transport_in[1:],
+                [1.0],
             )
-
-        d["A"] = r.Output[0]
-        d["V"] = r.Output[1]
+            d["A"] = r.Output[0]
+            d["V"] = r.Output[1]
         d["fld"] = self
 
         return ThermoProp(**d)
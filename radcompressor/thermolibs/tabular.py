@@ -0,0 +1,442 @@
+"""Tabular property backend built on top of CoolProp
+
+Single-phase properties are precomputed with the HEOS backend on a regular
+grid in (ln P, h) and evaluated with bicubic interpolation. Two-phase states
+are obtained by mixing saturated properties, which are tabulated along the
+pressure axis. The "PT", "PS" and "HS" inputs are resolved by inverting the
+interpolant along one grid direction. States that the table cannot resolve
+(outside of its range or too close to the saturation lines or the critical
+point) are flashed with HEOS.
+
+Tables can be persisted in a directory (`cache_dir`), in which case they are
+memory-mapped read-only, so that processes on the same node share one copy.
+"""
+__all__ = ["PropertyTable", "TabularCoolPropFluid"]
+
+import hashlib
+import json
+import math
+import os
+import pathlib
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import CoolProp as CP
+import numpy as np
+
+from .base import Fluid, ThermoProp
+from .coolprop import CoolPropFluid
+
+
+# Single-phase outputs, the density is interpolated as ln(D)
+table_outputs = ("T", "D", "S", "A", "V")
+_T, _D, _S, _A, _V = range(len(table_outputs))
+
+# Saturation outputs, vapor speed of sound and viscosity are used in two-phase
+sat_outputs = ("T", "H_liq", "H_vap", "S_liq", "S_vap", "D_liq", "D_vap", "A", "V")
+_TSAT, _HL, _HV, _SL, _SV, _DL, _DV, _AV, _VV = range(len(sat_outputs))
+
+gas_phases = (CP.iphase_gas, CP.iphase_supercritical, CP.iphase_supercritical_gas)
+
+# Version of the persisted tables, part of their key
+table_version = 1
+
+# Hermite basis, p(t) = [1 t t^2 t^3] M [f(0) f(1) f'(0) f'(1)]
+_M = np.array(
+    [
+        [1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, 1.0, 0.0],
+        [-3.0, 3.0, -2.0, -1.0],
+        [2.0, -2.0, 1.0, 1.0],
+    ]
+)
+
+
+def _powers(t: float) -> np.ndarray:
+    return np.array([1.0, t, t * t, t * t * t])
+
+
+def _cubic_root(b: list, target: float) -> float:
+    """Root in [0, 1] of b0 + b1 t + b2 t^2 + b3 t^3 = target (safeguarded Newton)"""
+    b0, b1, b2, b3 = b
+    b0 -= target
+    lo, hi = 0.0, 1.0
+    f_lo = b0
+    f_hi = b0 + b1 + b2 + b3
+    if f_lo == f_hi:
+        return 0.0
+    t = min(max(f_lo / (f_lo - f_hi), 0.0), 1.0)
+    for _ in range(50):
+        f = b0 + t * (b1 + t * (b2 + t * b3))
+        if (f < 0) == (f_lo < 0):
+            lo, f_lo = t, f
+        else:
+            hi = t
+        df = b1 + t * (2 * b2 + 3 * t * b3)
+        t_new = t - f / df if df != 0 else -1.0
+        if not lo < t_new < hi:
+            t_new = 0.5 * (lo + hi)
+        if abs(t_new - t) < 1e-13:
+            return t_new
+        t = t_new
+    return t
+
+
+@dataclass
+class PropertyTable:
+    """Bicubic property table over a regular (ln P, h) grid"""
+
+    x: np.ndarray  # ln(P) nodes
+    y: np.ndarray  # Enthalpy nodes
+    coeffs: np.ndarray  # Single-phase coefficients (output, cell_x, cell_y, 4, 4)
+    sat_coeffs: np.ndarray  # Saturation coefficients (output, cell_x, 4)
+    P_crit: float
+    T_crit: float
+
+    @classmethod
+    def build(
+        cls,
+        state: "CP.AbstractState",
+        P_range: Tuple[float, float],
+        H_range: Tuple[float, float],
+        n_P: int,
+        n_H: int,
+    ) -> "PropertyTable":
+        """Tabulate the properties of `state` with HEOS flashes
+
+        Nodes that are not in the gas or supercritical regions are left
+        undefined, so that the cells next to the saturation lines fall back to
+        HEOS instead of interpolating across them.
+        """
+        x = np.linspace(math.log(P_range[0]), math.log(P_range[1]), n_P)
+        y = np.linspace(H_range[0], H_range[1], n_H)
+        P_crit = state.p_critical()
+        T_crit = state.T_critical()
+
+        values = np.full((len(table_outputs), n_P, n_H), np.nan)
+        sat = np.full((len(sat_outputs), n_P), np.nan)
+        for i, P in enumerate(np.exp(x)):
+            if P < P_crit:
+                try:
+                    state.update(CP.PQ_INPUTS, P, 0.0)
+                    sat[[_HL, _SL, _DL], i] = (
+                        state.hmass(),
+                        state.smass(),
+                        math.log(state.rhomass()),
+                    )
+                    state.update(CP.PQ_INPUTS, P, 1.0)
+                    sat[[_TSAT, _HV, _SV, _DV, _AV, _VV], i] = (
+                        state.T(),
+                        state.hmass(),
+                        state.smass(),
+                        math.log(state.rhomass()),
+                        state.speed_sound(),
+                        state.viscosity(),
+                    )
+                except ValueError:
+                    sat[:, i] = np.nan
+            for j, h in enumerate(y):
+                try:
+                    state.update(CP.HmassP_INPUTS, h, P)
+                    if state.phase() not in gas_phases:
+                        continue
+                    values[:, i, j] = (
+                        state.T(),
+                        math.log(state.rhomass()),
+                        state.smass(),
+                        state.speed_sound(),
+                        state.viscosity(),
+                    )
+                except ValueError:
+                    values[:, i, j] = np.nan
+
+        # Hermite coefficients with derivatives in grid units, which are
+        # undefined next to undefined nodes
+        f_u = np.gradient(values, axis=1)
+        f_v = np.gradient(values, axis=2)
+        f_uv = np.gradient(f_u, axis=2)
+        F = np.empty((len(table_outputs), n_P - 1, n_H - 1, 4, 4))
+        for a, di in enumerate((0, 1)):
+            for b, dj in enumerate((0, 1)):
+                sl = (slice(None), slice(di, n_P - 1 + di), slice(dj, n_H - 1 + dj))
+                F[..., a, b] = values[sl]
+                F[..., a, b + 2] = f_v[sl]
+                F[..., a + 2, b] = f_u[sl]
+                F[..., a + 2, b + 2] = f_uv[sl]
+        coeffs = _M @ F @ _M.T
+
+        sat_u = np.gradient(sat, axis=1)
+        F_sat = np.stack([sat[:, :-1], sat[:, 1:], sat_u[:, :-1], sat_u[:, 1:]], -1)
+        sat_coeffs = F_sat @ _M.T
+
+        return cls(x, y, coeffs, sat_coeffs, P_crit, T_crit)
+
+    def save(self, path: pathlib.Path):
+        """Write the table to the directory `path`, atomically"""
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=path.parent, prefix=".tmp-"))
+        try:
+            for k in ("x", "y", "coeffs", "sat_coeffs"):
+                np.save(tmp / f"{k}.npy", getattr(self, k))
+            with open(tmp / "meta.json", "w") as f:
+                json.dump({"P_crit": self.P_crit, "T_crit": self.T_crit}, f)
+            os.replace(tmp, path)
+        except OSError:
+            # Another process wrote the table first
+            if not path.is_dir():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "PropertyTable":
+        """Memory-map the table saved in the directory `path`, read-only"""
+        path = pathlib.Path(path)
+        arrays = {
+            # Plain ndarray views are faster to index than memmap
+            k: np.asarray(np.load(path / f"{k}.npy", mmap_mode="r"))
+            for k in ("x", "y", "coeffs", "sat_coeffs")
+        }
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        return cls(**arrays, **meta)
+
+    def _cell(self, nodes: np.ndarray, value: float) -> Optional[Tuple[int, float]]:
+        t = (value - nodes[0]) / (nodes[1] - nodes[0])
+        n_cells = len(nodes) - 1
+        if not 0.0 <= t <= n_cells:
+            return None
+        i = min(int(t), n_cells - 1)
+        return i, t - i
+
+    def evaluate(self, x: float, h: float) -> Optional[list]:
+        """Single-phase outputs at (ln P, h), None if the table is undefined"""
+        cell_x = self._cell(self.x, x)
+        cell_y = self._cell(self.y, h)
+        if cell_x is None or cell_y is None:
+            return None
+        i, u = cell_x
+        j, v = cell_y
+        out = (_powers(u) @ self.coeffs[:, i, j] @ _powers(v)).tolist()
+        if math.isnan(sum(out)):
+            return None
+        out[_D] = math.exp(out[_D])
+        return out
+
+    def saturation(self, x: float) -> Optional[list]:
+        """Saturation outputs at ln P, None if the table is undefined"""
+        cell_x = self._cell(self.x, x)
+        if cell_x is None:
+            return None
+        i, u = cell_x
+        out = (self.sat_coeffs[:, i] @ _powers(u)).tolist()
+        if math.isnan(sum(out)):
+            return None
+        out[_DL] = math.exp(out[_DL])
+        out[_DV] = math.exp(out[_DV])
+        return out
+
+    def solve_h(self, x: float, k: int, target: float) -> Optional[float]:
+        """Enthalpy at which output `k` equals `target` along the ln P = x line"""
+        cell_x = self._cell(self.x, x)
+        if cell_x is None:
+            return None
+        i, u = cell_x
+        p = _powers(u)
+        C = self.coeffs[k, i]
+        j = self._crossing(C[:, :, 0] @ p, p @ C[-1].sum(axis=1), target)
+        if j is None:
+            return None
+        v = _cubic_root((p @ C[j]).tolist(), target)
+        return self.y[0] + (j + v) * (self.y[1] - self.y[0])
+
+    def solve_x(self, h: float, k: int, target: float) -> Optional[float]:
+        """ln P at which output `k` equals `target` along the enthalpy h line"""
+        cell_y = self._cell(self.y, h)
+        if cell_y is None:
+            return None
+        j, v = cell_y
+        p = _powers(v)
+        C = self.coeffs[k, :, j]
+        i = self._crossing(C[:, 0, :] @ p, C[-1].sum(axis=0) @ p, target)
+        if i is None:
+            return None
+        u = _cubic_root((C[i] @ p).tolist(), target)
+        return self.x[0] + (i + u) * (self.x[1] - self.x[0])
+
+    @staticmethod
+    def _crossing(edges: np.ndarray, last: float, target: float) -> Optional[int]:
+        """First cell whose edge values bracket `target`"""
+        edges = np.append(edges, last) - target
+        idx = np.flatnonzero(edges[:-1] * edges[1:] <= 0)
+        if idx.size == 0:
+            return None
+        return idx[0]
+
+
+@dataclass
+class TabularCoolPropFluid(CoolPropFluid):
+    """CoolProp fluid evaluated from precomputed bicubic property tables
+
+    The table covers `P_range` x `H_range` with `n_P` logarithmically spaced
+    pressures and `n_H` enthalpies. By default, it spans the whole gas and
+    two-phase domain of the fluid. Use `error_bounds` to check the accuracy of
+    a given table against HEOS.
+
+    With `cache_dir`, the table is loaded from that directory if it was built
+    before with the same fluid, ranges and resolution, and saved there
+    otherwise.
+    """
+
+    P_range: Optional[Tuple[float, float]] = None
+    H_range: Optional[Tuple[float, float]] = None
+    n_P: int = 200
+    n_H: int = 200
+    cache_dir: Optional[str] = None
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.P_range is None:
+            self.P_range = (self.P_triple, self.P_max)
+        if self.H_range is None:
+            self.state.update(CP.QT_INPUTS, 0.0, self.T_triple)
+            h_min = self.state.hmass()
+            self.state.update(CP.PT_INPUTS, self.P_range[0], self.T_max)
+            self.H_range = (h_min, self.state.hmass())
+        if self.cache_dir is None:
+            self.table = self._build()
+            return
+        path = pathlib.Path(self.cache_dir) / self.table_key()
+        if not path.is_dir():
+            self._build().save(path)
+        self.table = PropertyTable.load(path)
+
+    def _build(self) -> PropertyTable:
+        return PropertyTable.build(
+            self.state, self.P_range, self.H_range, self.n_P, self.n_H
+        )
+
+    def table_key(self) -> str:
+        """Name of the persisted table of this fluid, ranges and resolution"""
+        key = (
+            self.name.upper(),
+            [float(v) for v in self.P_range],
+            [float(v) for v in self.H_range],
+            self.n_P,
+            self.n_H,
+            CP.__version__,
+            table_version,
+        )
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+        return f"{self.name}-{digest}"
+
+    def thermo_prop(
+        self, in_type, in1, in2, outputs=None, phase=None, errors="raise"
+    ) -> "ThermoProp":
+        # All outputs are interpolated at once, `outputs` and `phase` only
+        # apply to HEOS
+        tp = None
+        if isinstance(in_type, str):
+            tp = self._table_prop(in_type, in1, in2, errors)
+        if tp is None:
+            return super().thermo_prop(in_type, in1, in2, outputs, phase, errors)
+        return tp
+
+    # Element-wise flashes through the table instead of the HEOS batch
+    thermo_prop_batch = Fluid.thermo_prop_batch
+    thermo_prop_isentropic = Fluid.thermo_prop_isentropic
+
+    def _table_prop(self, in_type: str, in1: float, in2: float, errors: str):
+        """Flash from the table, None if the table cannot resolve the state"""
+        table = self.table
+        if in_type == "HS":
+            x = table.solve_x(in1, _S, in2)
+            if x is None:
+                return None
+            return self._gas_prop(math.exp(x), x, in1, S=in2)
+        if in_type not in ("PH", "PT", "PS") or not in1 > 0:
+            return None
+
+        x = math.log(in1)
+        if in1 < table.P_crit:
+            sat = table.saturation(x)
+            if sat is None:
+                return None
+            if in_type == "PH":
+                q = (in2 - sat[_HL]) / (sat[_HV] - sat[_HL])
+            elif in_type == "PS":
+                q = (in2 - sat[_SL]) / (sat[_SV] - sat[_SL])
+            else:
+                q = 1.0 + (in2 - sat[_TSAT]) / sat[_TSAT]
+            # Leave states on the saturation lines to HEOS
+            if abs(q) < 1e-6 or abs(q - 1.0) < 1e-6:
+                return None
+            if q < 0 or (q < 1 and in_type == "PT"):
+                return self._failed(errors, "Not gas or two-phase")
+            if q < 1:
+                return self._twophase_prop(in1, sat, q)
+
+        if in_type == "PH":
+            return self._gas_prop(in1, x, in2)
+        if in_type == "PT":
+            return self._gas_prop(in1, x, table.solve_h(x, _T, in2), T=in2)
+        return self._gas_prop(in1, x, table.solve_h(x, _S, in2), S=in2)
+
+    def _gas_prop(self, P, x, h, **exact):
+        if h is None:
+            return None
+        out = self.table.evaluate(x, h)
+        if out is None:
+            return None
+        d = dict(zip(table_outputs, out))
+        d.update(exact)
+        if d["T"] <= self.table.T_crit:
+            if P >= self.table.P_crit:
+                return None
+            d["phase"] = "gas"
+        elif P < self.table.P_crit:
+            d["phase"] = "supercritical_gas"
+        else:
+            d["phase"] = "supercritical"
+        return ThermoProp(P=P, H=h, fld=self, **d)
+
+    def _twophase_prop(self, P, sat, q):
+        return ThermoProp(
+            P=P,
+            T=sat[_TSAT],
+            D=1.0 / ((1 - q) / sat[_DL] + q / sat[_DV]),
+            H=sat[_HL] + q * (sat[_HV] - sat[_HL]),
+            S=sat[_SL] + q * (sat[_SV] - sat[_SL]),
+            A=sat[_AV],
+            V=sat[_VV],
+            phase="twophase",
+            fld=self,
+        )
+
+    def error_bounds(self, n_samples: int = 2000, seed: int = 0) -> Dict[str, float]:
+        """Maximum relative error of the table against HEOS on random states
+
+        The states are sampled uniformly in (ln P, h) over the table, states
+        resolved by HEOS are not counted. The error on S is relative to the
+        entropy span of the table.
+        """
+        rng = np.random.default_rng(seed)
+        x = rng.uniform(self.table.x[0], self.table.x[-1], n_samples)
+        h = rng.uniform(self.table.y[0], self.table.y[-1], n_samples)
+        S_nodes = self.table.coeffs[_S, :, :, 0, 0]
+        S_span = np.nanmax(S_nodes) - np.nanmin(S_nodes)
+
+        errors = {k: 0.0 for k in table_outputs}
+        for P, h_ in zip(np.exp(x), h):
+            tab = self._table_prop("PH", P, h_, errors="nan")
+            if tab is None or not tab.valid:
+                continue
+            ref = super().thermo_prop("PH", P, h_)
+            for k in table_outputs:
+                scale = S_span if k == "S" else abs(getattr(ref, k))
+                err = abs(getattr(tab, k) - getattr(ref, k)) / scale
+                errors[k] = max(errors[k], err)
+        return errors
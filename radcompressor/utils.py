@@ -1,11 +1,14 @@
+import itertools
 import time
-from typing import Iterator, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 
 from .compressor import Compressor
 from .condition import OperatingCondition
 from .geometry import Geometry
+from .solvers import Solver
 from .thermo import ThermoProp
 
 
@@ -53,7 +56,21 @@ def calculate_on_op_grid(
     ub: np.ndarray,
     resolution=0.005,
     map_func=map,
+    n_threads: Optional[int] = None,
+    continuation: bool = False,
+    delta_check: bool = True,
+    dif_kwargs: Optional[dict] = None,
+    solvers: Optional[Dict[str, Solver]] = None,
 ) -> Tuple[np.ndarray, Iterator]:
+    """Evaluate the compressor on a grid of (n_rot, m) between `lb` and `ub`
+
+    With `n_threads`, the points are evaluated by a pool of threads instead of
+    `map_func` and the results are returned as a list. With `continuation`,
+    the speed lines are mapped instead of the points, and each point starts
+    from the solution of the previous point of its speed line. `dif_kwargs`
+    are the options of the diffusers, e.g. `{"adaptive": True}`, and `solvers`
+    the strategies of the stages, e.g. `{"imp": Solver("lm")}`.
+    """
     if not isinstance(resolution, List):
         resolution = [resolution, resolution]
     xx, yy = np.mgrid[0 : 1 : resolution[0], 0 : 1 : resolution[1]]
@@ -61,13 +78,45 @@ def calculate_on_op_grid(
 
     X = grid * (ub - lb) + lb
 
-    def calculate_compressor(x: List[float]) -> Tuple[Compressor, float]:
+    def calculate_compressor(
+        x: List[float], guess: Optional[Compressor] = None
+    ) -> Tuple[Compressor, float]:
         n_rot, m = x
         op = OperatingCondition(in0=in0, fld=in0.fld, m=m, n_rot=n_rot)
         t0 = time.perf_counter()
-        comp = Compressor(geom, op)
-        comp.calculate()
+        comp = Compressor(geom, op, dif_kwargs, solvers)
+        comp.calculate(delta_check=delta_check, guess=guess)
         dt = time.perf_counter() - t0
         return comp, dt
 
-    return X, map_func(calculate_compressor, X.tolist())
+    def calculate_speed_line(line: List[List[float]]) -> List[Tuple[Compressor, float]]:
+        results = []
+        guess = None
+        for x in line:
+            comp, dt = calculate_compressor(x, guess)
+            results.append((comp, dt))
+            guess = comp
+        return results
+
+    if continuation:
+        func = calculate_speed_line
+        points = X.reshape(*xx.shape, 2).tolist()
+    else:
+        func = calculate_compressor
+        points = X.tolist()
+
+    if n_threads is not None:
+        results = threaded_map(func, points, n_threads)
+    else:
+        results = map_func(func, points)
+    if continuation:
+        results = itertools.chain.from_iterable(results)
+        if n_threads is not None:
+            results = list(results)
+    return X, results
+
+
+def threaded_map(func, iterable, n_threads: Optional[int] = None) -> list:
+    """Ordered results of `func` over `iterable` using a pool of threads"""
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(func, iterable))
@@ -0,0 +1,462 @@
+import time
+
+import click
+import numpy as np
+import yaml
+from scipy import optimize
+
+from radcompressor import solvers, thermo
+from radcompressor.compressor import Compressor
+from radcompressor.condition import OperatingCondition
+from radcompressor.correlations import moody
+from radcompressor.diffuser import VanelessDiffuser
+from radcompressor.geometry import Geometry
+from radcompressor.utils import calculate_on_op_grid, upper_bounds
+
+
+def timed(func, args_list, repeat):
+    """Best time per call (in us) of `func` over `args_list`"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(args_list) * 1e6
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option("--fluid", "-f", "fluid_list", multiple=True, default=["R134a", "CO2"])
+@click.option("--n-points", "-n", default=500, help="Number of total states")
+@click.option("--repeat", "-r", default=3)
+@click.option("--seed", default=0)
+def static_total(fluid_list, n_points, repeat, seed):
+    """Compare the isentropic conversion with the "HS" flash"""
+    rng = np.random.default_rng(seed)
+    for name in fluid_list:
+        fld = thermo.CoolPropFluid(name)
+        T = rng.uniform(1.05, 1.5, n_points) * fld.T_crit
+        P = rng.uniform(0.05, 0.8, n_points) * fld.P_crit
+        speed = rng.uniform(10, 300, n_points)
+
+        args_list = []
+        for Pi, Ti, ci in zip(P, T, speed):
+            tot = fld.thermo_prop("PT", Pi, Ti)
+            try:
+                fld.thermo_prop("HS", tot.H - 0.5 * ci**2, tot.S)
+            except thermo.ThermoException:
+                continue
+            args_list.append((tot, ci))
+
+        def hs_flash(tot, c):
+            return fld.thermo_prop("HS", tot.H - 0.5 * c**2, tot.S)
+
+        t_hs = timed(hs_flash, args_list, repeat)
+        t_is = timed(thermo.static_from_total, args_list, repeat)
+        err = max(
+            abs(hs_flash(*a).P / thermo.static_from_total(*a).P - 1) for a in args_list
+        )
+        click.echo(
+            f"{name:>8}: {len(args_list)} points, HS {t_hs:.1f} us, "
+            f"isentropic {t_is:.1f} us, speedup {t_hs / t_is:.1f}x, "
+            f"max rel. P diff {err:.1e}"
+        )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.2, help="Resolution of the operating grid")
+@click.option("--repeat", "-r", default=3)
+def phase_hint(compressors, resolution, repeat):
+    """Compare the grid with and without the gas hint of the stage flashes"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+        times = {None: np.inf, "gas": np.inf}
+        valid = {}
+        try:
+            for _ in range(repeat):
+                for hint in times:
+                    thermo.gas_hint = hint
+                    _, results = calculate_on_op_grid(
+                        geom, in0, 0.05 * ub, ub, resolution
+                    )
+                    start = time.perf_counter()
+                    valid[hint] = [not comp.invalid_flag for comp, _ in results]
+                    times[hint] = min(times[hint], time.perf_counter() - start)
+        finally:
+            thermo.gas_hint = None
+        hinted, fallbacks = (n // repeat for n in fld.phase_hint_info())
+        click.echo(
+            f"{c['name']} ({fld.name}): {len(valid[None])} points, "
+            f"{times[None]:.2f} s unhinted, {times['gas']:.2f} s hinted "
+            f"(speedup {times[None] / times['gas']:.2f}x), {hinted} hinted "
+            f"flashes, {fallbacks} fallbacks, "
+            f"{np.sum(np.array(valid[None]) != valid['gas'])} validity changed"
+        )
+
+
+@main.command("moody")
+@click.option("--n-points", "-n", default=2000, help="Number of points")
+@click.option("--repeat", "-r", default=3)
+@click.option("--seed", default=0)
+def moody_(n_points, repeat, seed):
+    """Compare the friction factor with the former fsolve implementation"""
+
+    def moody_fsolve(Re, r):
+        def colebrook(x):
+            return -2 * np.log10(r / 3.72 + 2.51 / Re / x**0.5) - 1 / x**0.5
+
+        return optimize.fsolve(colebrook, 0.02)[0]
+
+    rng = np.random.default_rng(seed)
+    Re = 10 ** rng.uniform(np.log10(2300), 6, n_points)
+    r = 10 ** rng.uniform(-6, -2, n_points)
+    args_list = list(zip(Re, r))
+
+    t_fsolve = timed(moody_fsolve, args_list, repeat)
+    t_scalar = timed(moody, args_list, repeat)
+    t_array = timed(moody, [(Re, r)], repeat) / n_points
+    err = np.abs(moody(Re, r) / [moody_fsolve(*a) for a in args_list] - 1).max()
+    click.echo(
+        f"{n_points} points, fsolve {t_fsolve:.1f} us, scalar {t_scalar:.2f} us "
+        f"(speedup {t_fsolve / t_scalar:.0f}x), array {t_array:.3f} us per point, "
+        f"max rel. diff {err:.1e}"
+    )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.1, help="Resolution of the operating grid")
+def delta_check(compressors, resolution):
+    """Compare the warm-started surge check with a cold perturbed solve"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+        X, results = calculate_on_op_grid(
+            geom, in0, 0.05 * ub, ub, resolution, delta_check=False
+        )
+
+        t_cold = t_warm = 0.0
+        nfev_cold = nfev_warm = n = n_diff = 0
+        slope_diff = 0.0
+        for (n_rot, m), (comp, _) in zip(X, results):
+            if comp.invalid_flag:
+                continue
+            d_op = OperatingCondition(in0=in0, fld=fld, m=m * 1.005, n_rot=n_rot)
+            slopes = []
+            for guess in (None, comp):
+                d_comp = Compressor(geom, d_op)
+                start = time.perf_counter()
+                d_comp.calculate(delta_check=False, guess=guess)
+                dt = time.perf_counter() - start
+                nfev = sum(s.nfev for s in (d_comp.ind, d_comp.imp, d_comp.dif) if s)
+                if guess is None:
+                    t_cold, nfev_cold = t_cold + dt, nfev_cold + nfev
+                else:
+                    t_warm, nfev_warm = t_warm + dt, nfev_warm + nfev
+                slopes.append(
+                    (d_comp.head - comp.head) / (d_comp.flow - comp.flow)
+                    if not d_comp.invalid_flag
+                    else np.nan
+                )
+            n += 1
+            n_diff += (slopes[0] > -1e-4) != (slopes[1] > -1e-4)
+            slope_diff = max(slope_diff, abs(slopes[1] / slopes[0] - 1))
+
+        click.echo(
+            f"{c['name']}: {n} checks, cold {t_cold / max(n, 1) * 1e3:.1f} ms "
+            f"({nfev_cold} evaluations), warm {t_warm / max(n, 1) * 1e3:.1f} ms "
+            f"({nfev_warm} evaluations), speedup {t_cold / max(t_warm, 1e-9):.1f}x, "
+            f"{n_diff} surge flags changed, max rel. slope diff {slope_diff:.1e}"
+        )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.1, help="Resolution of the operating grid")
+def jacobian(compressors, resolution):
+    """Compare the Jacobians of the stages with the forward differences"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+
+        runs = {}
+        for analytic in (False, True):
+            solvers.analytic_jacobians = analytic
+            start = time.perf_counter()
+            _, results = calculate_on_op_grid(geom, in0, 0.05 * ub, ub, resolution)
+            comps = [comp for comp, _ in results]
+            dt = time.perf_counter() - start
+            nfev = sum(
+                s.nfev for comp in comps for s in (comp.ind, comp.imp, comp.dif) if s
+            )
+            runs[analytic] = dt, nfev, comps
+        solvers.analytic_jacobians = True
+
+        (t_fd, nfev_fd, fd), (t_an, nfev_an, an) = runs[False], runs[True]
+        n_diff = sum(a.invalid_flag != b.invalid_flag for a, b in zip(fd, an))
+        eff_diff = max(
+            (
+                abs(a.eff - b.eff)
+                for a, b in zip(fd, an)
+                if not (a.invalid_flag or b.invalid_flag)
+            ),
+            default=0.0,
+        )
+        click.echo(
+            f"{c['name']}: {len(an)} points, differences {t_fd:.1f} s "
+            f"({nfev_fd} evaluations), analytic {t_an:.1f} s ({nfev_an} "
+            f"evaluations), speedup {t_fd / t_an:.1f}x, {n_diff} validity "
+            f"changed, max eff diff {eff_diff:.1e}"
+        )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.2, help="Resolution of the operating grid")
+@click.option("--n-steps", default=15, help="Number of steps of the diffuser")
+def diffuser(compressors, resolution, n_steps):
+    """Compare the marching diffuser with the solve of all the speeds at once"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+        X, results = calculate_on_op_grid(
+            geom, in0, 0.05 * ub, ub, resolution, delta_check=False
+        )
+
+        times = {False: 0.0, True: 0.0}
+        nfev = {False: 0, True: 0}
+        n = n_diff = 0
+        P_diff = 0.0
+        for (n_rot, m), (comp, _) in zip(X, results):
+            if comp.imp is None or comp.imp.out.is_not_set:
+                continue
+            op = OperatingCondition(in0=in0, fld=fld, m=m, n_rot=n_rot)
+            difs = {}
+            for marching in (False, True):
+                start = time.perf_counter()
+                difs[marching] = VanelessDiffuser(
+                    geom, op, comp.imp, n_steps=n_steps, marching=marching
+                )
+                times[marching] += time.perf_counter() - start
+                nfev[marching] += difs[marching].nfev
+            n += 1
+            n_diff += difs[False].choke_flag != difs[True].choke_flag
+            if not (difs[False].choke_flag or difs[True].choke_flag):
+                P0 = difs[False].out.total.P, difs[True].out.total.P
+                P_diff = max(P_diff, abs(P0[1] / P0[0] - 1))
+
+        click.echo(
+            f"{c['name']}: {n} diffusers, all at once {times[False] * 1e3 / max(n, 1):.2f} "
+            f"ms ({nfev[False]} evaluations), marching "
+            f"{times[True] * 1e3 / max(n, 1):.2f} ms ({nfev[True]} evaluations of a "
+            f"station), speedup {times[False] / max(times[True], 1e-9):.1f}x, "
+            f"{n_diff} choke flags changed, max rel. outlet P0 diff {P_diff:.1e}"
+        )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.2, help="Resolution of the operating grid")
+@click.option("--n-steps", default=15, help="Number of uniform steps of the diffuser")
+@click.option("--tol-p0", default=1e-3, help="Relative tolerance on the total pressure")
+@click.option("--tol-alpha", default=0.5, help="Tolerance on the flow angle in degrees")
+def steps(compressors, resolution, n_steps, tol_p0, tol_alpha):
+    """Compare the uniform and the adaptive steps of the diffuser, against an
+    extrapolation of 1000 and 2000 uniform steps"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+        X, results = calculate_on_op_grid(
+            geom, in0, 0.05 * ub, ub, resolution, delta_check=False
+        )
+
+        kwargs = {
+            "uniform": {"n_steps": n_steps},
+            "adaptive": {"adaptive": True, "tol_P0": tol_p0, "tol_alpha": tol_alpha},
+        }
+        times = dict.fromkeys(kwargs, 0.0)
+        stations = dict.fromkeys(kwargs, 0)
+        err_P0 = dict.fromkeys(kwargs, 0.0)
+        err_alpha = dict.fromkeys(kwargs, 0.0)
+        n = 0
+        for (n_rot, m), (comp, _) in zip(X, results):
+            if comp.dif is None or comp.dif.choke_flag:
+                continue
+            op = OperatingCondition(in0=in0, fld=fld, m=m, n_rot=n_rot)
+            fine, finer = (
+                VanelessDiffuser(geom, op, comp.imp, n_steps=k) for k in (1000, 2000)
+            )
+            P0 = 2 * finer.out.total.P - fine.out.total.P
+            alpha = 2 * finer.out.alpha - fine.out.alpha
+            for k, kw in kwargs.items():
+                start = time.perf_counter()
+                dif = VanelessDiffuser(geom, op, comp.imp, **kw)
+                times[k] += time.perf_counter() - start
+                stations[k] += len(dif.x)
+                err_P0[k] = max(err_P0[k], abs(dif.out.total.P / P0 - 1))
+                err_alpha[k] = max(err_alpha[k], abs(dif.out.alpha - alpha))
+            n += 1
+
+        click.echo(
+            f"{c['name']}: {n} diffusers, "
+            + ", ".join(
+                f"{k} {times[k] * 1e3 / max(n, 1):.2f} ms "
+                f"({stations[k] / max(n, 1):.1f} stations, max rel. P0 error "
+                f"{err_P0[k]:.1e}, max alpha error {err_alpha[k]:.3f} deg)"
+                for k in kwargs
+            )
+        )
+
+
+@main.command()
+@click.option(
+    "--compressors",
+    "-c",
+    type=click.Path(exists=True, dir_okay=False),
+    default="data/known_compressors.yml",
+)
+@click.option("--resolution", default=0.1, help="Resolution of the operating grid")
+@click.option(
+    "--method",
+    "-m",
+    "methods",
+    multiple=True,
+    default=solvers.solver_methods,
+    help="Methods of the strategies, all by default",
+)
+@click.option(
+    "--stage",
+    "-s",
+    "stages",
+    multiple=True,
+    default=("ind", "imp", "dif"),
+    help="Stages solved by the strategies, the others by hybr",
+)
+def strategies(compressors, resolution, methods, stages):
+    """Compare the solver strategies of the stages on the known compressors"""
+    with open(compressors) as f:
+        db = yaml.safe_load(f)
+    grids = []
+    for c in db:
+        geom = Geometry.from_dict(c["geom"])
+        fld = thermo.CoolPropFluid(c["conditions"]["fluid"])
+        in0 = fld.thermo_prop(
+            "PT", float(c["conditions"]["in_P"]), float(c["conditions"]["in_T"])
+        )
+        ub = np.array(upper_bounds(geom, in0))
+        grids.append((geom, in0, ub))
+
+    runs = {}
+    for method in ("hybr", *(m for m in methods if m != "hybr")):
+        solver = solvers.Solver(method)
+        start = time.perf_counter()
+        comps = []
+        for geom, in0, ub in grids:
+            _, results = calculate_on_op_grid(
+                geom,
+                in0,
+                0.05 * ub,
+                ub,
+                resolution,
+                solvers=dict.fromkeys(stages, solver),
+            )
+            comps.extend(comp for comp, _ in results)
+        dt = time.perf_counter() - start
+        runs[method] = comps
+
+        stage_counts = {
+            stage: [
+                sum(
+                    getattr(getattr(comp, stage), k)
+                    for comp in comps
+                    if getattr(comp, stage)
+                )
+                for k in ("nit", "nfev")
+            ]
+            for stage in ("ind", "imp", "dif")
+        }
+        hybr = runs["hybr"]
+        n_diff = sum(a.invalid_flag != b.invalid_flag for a, b in zip(hybr, comps))
+        eff_diff = max(
+            (
+                abs(a.eff - b.eff)
+                for a, b in zip(hybr, comps)
+                if not (a.invalid_flag or b.invalid_flag)
+            ),
+            default=0.0,
+        )
+        click.echo(
+            f"{method}: {len(comps)} points in {dt:.1f} s, "
+            + ", ".join(
+                f"{stage} {nit} iterations {nfev} evaluations"
+                for stage, (nit, nfev) in stage_counts.items()
+            )
+            + f", {sum(not comp.invalid_flag for comp in comps)} valid, "
+            f"{n_diff} validity changed, max eff diff {eff_diff:.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -57,10 +57,7 @@ def main(
     else:
         parameters.update(parameters_wide)
     # Prepare fluid and load to check if it exists
-    if fluid_type == "coolprop":
-        fld = {f: thermo.CoolPropFluid(f) for f in fluid_list}
-    elif fluid_type == "refprop":
-        fld = {f: thermo.RefpropFluid(f) for f in fluid_list}
+    fld = {f: thermo.get_backend(fluid_type)(f) for f in fluid_list}
 
     # Prepare rng
     rng = np.random.default_rng()
@@ -92,10 +89,9 @@ def main(
         Teff = rng.uniform(low=T_low, high=T_high, size=n_geom * n_inlet)
 
         Pmax = P_crit * (Teff > T_crit)
-        Pmax[Pmax == 0] = [
-            fld[f].thermo_prop("TQ", t, 1).P - 1.1e-4
-            for t, f in zip(Teff[Pmax == 0], fluids[Pmax == 0])
-        ]
+        for f in fluid_list:
+            sel = (Pmax == 0) & (fluids == f)
+            Pmax[sel] = fld[f].thermo_prop_batch("TQ", Teff[sel], 1).P - 1.1e-4
         # 1.1e-4 added to avoid Coolprop issues
 
         Pmax[Pmax > P_crit / 3] = P_crit[Pmax > P_crit / 3] / 3
@@ -106,10 +102,10 @@ def main(
         Peff = Pmax / Peff_r
 
         # Validate that each condition is valid
-        [
-            fld[f].thermo_prop("PT", p, t).P - 1.1e-4
-            for t, f, p in zip(Teff, fluids, Peff)
-        ]
+        for f in fluid_list:
+            sel = fluids == f
+            if not fld[f].thermo_prop_batch("PT", Peff[sel], Teff[sel]).valid.all():
+                raise thermo.ThermoException(f"Invalid inlet conditions for {f}")
 
         m_in = rng.uniform(
             low=parameters["m_in"][0],
@@ -14,8 +14,8 @@ from dask.distributed import Client
 
 from radcompressor.compressor import Compressor
 from radcompressor.condition import OperatingCondition
-from radcompressor.geometry import Geometry
-from radcompressor.thermo import CoolPropFluid
+from radcompressor.geometry import GeometryTable
+from radcompressor.thermo import CoolPropFluid, get_fluid
 
 
 out_meta = {
@@ -52,13 +52,15 @@ out_thermo_meta = pd.DataFrame(out_thermo_meta)
 
 def simulate(df, geom_file=None, add_thermo=False):
     df = df.reset_index(drop=False)
-    geom_t = pq.read_table(
-        geom_file,
-        filters=[
-            ("geom_id", ">=", df.geom_id.min()),
-            ("geom_id", "<=", df.geom_id.max()),
-        ],
-    ).to_pandas()
+    geom_t = GeometryTable.from_columns(
+        pq.read_table(
+            geom_file,
+            filters=[
+                ("geom_id", ">=", df.geom_id.min()),
+                ("geom_id", "<=", df.geom_id.max()),
+            ],
+        )
+    )
 
     out_m = out_thermo_meta if add_thermo else out_meta
     out = {n: np.empty(len(df), dtype=t) for n, t in out_m.dtypes.items()}
@@ -68,8 +70,8 @@ def simulate(df, geom_file=None, add_thermo=False):
     out["fluid"] = df.fluid
 
     for row in df.itertuples():
-        fld = CoolPropFluid(row.fluid)
-        geom = Geometry.from_dict(geom_t.loc[row.geom_id, :].to_dict())
+        fld = get_fluid(CoolPropFluid, row.fluid)
+        geom = geom_t[row.geom_id]
         in0 = fld.thermo_prop("PT", row.in_P, row.in_T)
         if add_thermo:
             out["in0_mu"][row.Index] = in0.V
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from radcompressor.thermo import CoolPropFluid
+from radcompressor.utils import calculate_on_op_grid, scaled_geometry, upper_bounds
+
+
+@pytest.fixture(scope="session")
+def geom():
+    """Geometry of the operating grids of the tests"""
+    return scaled_geometry(0.02, -45, 0.08, 9, 0.7, 3, 1e-4, 0.02)
+
+
+@pytest.fixture(scope="session")
+def in0():
+    """R134a inlet of the operating grids of the tests"""
+    return CoolPropFluid("R134a").thermo_prop("PT", 3e5, 300)
+
+
+@pytest.fixture(scope="session")
+def ub(geom, in0):
+    """Upper bounds of the speed and the mass flow of `geom`"""
+    return np.array(upper_bounds(geom, in0))
+
+
+@pytest.fixture(scope="session")
+def op_grid(geom, in0, ub):
+    """Points and results of the default solve of the grid from 0.1 * ub to ub,
+    shared by the tests, which must not modify the compressors"""
+    X, res = calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25)
+    return X, list(res)
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 from radcompressor.correlations import moody
 
@@ -14,3 +15,15 @@ def test_turbulent_flow():
     Re = 5000.0
     r = 0.01
     assert moody(Re, r) == pytest.approx(0.0472, rel=1e-3)
+
+
+def test_colebrook_residual():
+    # Test that Colebrook's equation is solved, also for arrays
+    Re = np.geomspace(2300.0, 1e9, 50)[:, None]
+    r = np.array([0.0, 1e-5, 1e-3, 0.05])
+    f = moody(Re, r)
+    assert f.shape == (50, 4)
+    res = -2 * np.log10(r / 3.72 + 2.51 / Re / f**0.5) - 1 / f**0.5
+    assert np.abs(res * f**0.5).max() < 1e-14
+    assert f[10, 2] == moody(Re[10, 0], r[2])
+    assert moody([1000.0, 5000.0], 0.01) == pytest.approx([0.064, 0.0472], rel=1e-3)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from radcompressor.condition import OperatingCondition
+from radcompressor.diffuser import VanelessDiffuser
+
+
+@pytest.mark.parametrize("n_steps", [15, 40])
+def test_marching_diffuser(n_steps, geom, in0, op_grid):
+    # Test that the marching diffuser gives the outlet of the solve of all the
+    # speeds at once
+    fld = in0.fld
+    X, res = op_grid
+
+    n = 0
+    for (n_rot, m), (comp, _) in zip(X, res):
+        if comp.invalid_flag:
+            continue
+        op = OperatingCondition(in0=in0, fld=fld, m=m, n_rot=n_rot)
+        coupled, marching = (
+            VanelessDiffuser(geom, op, comp.imp, n_steps=n_steps, marching=marching)
+            for marching in (False, True)
+        )
+        assert marching.choke_flag == coupled.choke_flag
+        np.testing.assert_allclose(marching.x, coupled.x, rtol=1e-6)
+        for k in ["P", "H"]:
+            out = getattr(marching.out.total, k)
+            assert out == pytest.approx(getattr(coupled.out.total, k), rel=1e-9)
+        assert marching.out.alpha == pytest.approx(coupled.out.alpha, rel=1e-9)
+        n += 1
+    assert n > 0
+
+
+def test_adaptive_diffuser(geom, in0, op_grid):
+    # Test that the adaptive steps are more accurate than as many uniform steps,
+    # against an extrapolation of fine uniform steps
+    fld = in0.fld
+    X, res = op_grid
+
+    n = 0
+    for (n_rot, m), (comp, _) in zip(X, res):
+        if comp.invalid_flag:
+            continue
+        op = OperatingCondition(in0=in0, fld=fld, m=m, n_rot=n_rot)
+        fine, finer = (
+            VanelessDiffuser(geom, op, comp.imp, n_steps=n) for n in (400, 800)
+        )
+        alpha = 2 * finer.out.alpha - fine.out.alpha
+        P0 = 2 * finer.out.total.P - fine.out.total.P
+
+        adaptive = VanelessDiffuser(geom, op, comp.imp, adaptive=True)
+        assert adaptive.r[-1] == geom.r5
+        assert adaptive.out.alpha == pytest.approx(alpha, abs=adaptive.tol_alpha)
+        assert adaptive.out.total.P == pytest.approx(P0, rel=adaptive.tol_P0)
+
+        uniform = VanelessDiffuser(geom, op, comp.imp, n_steps=len(adaptive.x))
+        assert abs(adaptive.out.alpha - alpha) < abs(uniform.out.alpha - alpha)
+        n += 1
+    assert n > 0
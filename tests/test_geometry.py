@@ -0,0 +1,61 @@
+import copy
+from dataclasses import asdict
+
+import numpy as np
+import pytest
+
+from radcompressor.geometry import GeometryTable
+from radcompressor.utils import scaled_geometry
+
+
+def test_derived_cache():
+    # Test that the derived quantities are cleared when a field is set
+    geom = scaled_geometry(0.02, -45, 0.08, 9, 0.7, 3, 1e-4, 0.02)
+    other = copy.deepcopy(geom)
+    assert geom.A_y == other.A_y
+    assert geom == other
+
+    geom.beta2 = -50
+    assert geom.A_y != other.A_y
+    assert geom.beta2_opt != other.beta2_opt
+    geom.beta2 = other.beta2
+    assert geom.beta2_opt == pytest.approx(other.beta2_opt, rel=1e-15)
+
+    geom.n_blades += 1
+    assert geom.slip > other.slip
+    assert geom.hydraulic_diameter[0] < other.hydraulic_diameter[0]
+
+    # The blockage is replaced, not modified in place
+    with pytest.raises(TypeError):
+        geom.blockage[0] = 0.9
+    geom.blockage = [0.9] + list(other.blockage[1:])
+    assert geom.blockage == (0.9,) + other.blockage[1:]
+    assert geom.A1_eff == pytest.approx(0.9 * other.A1_eff, rel=1e-15)
+
+
+def test_geometry_table():
+    # Test the rows and the vectorized derived quantities against Geometry
+    geoms = [scaled_geometry(0.02, d, 0.08, 9, 0.7, 3, 1e-4, 0.02) for d in (-40, -60)]
+    data = {"geom_id": [7, 3]}
+    for g in geoms:
+        for k, v in asdict(g).items():
+            if k == "blockage":
+                for i, b in enumerate(v):
+                    data.setdefault(f"blockage{i+1}", []).append(b)
+            else:
+                data.setdefault(k.upper(), []).append(v)
+
+    table = GeometryTable.from_columns(data)
+    assert len(table) == 2
+    assert table[3] == geoms[1]
+    assert table[3] is table[3]
+    for k in ["r2rms", "A1_eff", "A2_eff", "A_x", "A_y", "beta2_opt", "slip"]:
+        assert getattr(table, k) == pytest.approx([getattr(g, k) for g in geoms])
+        # The scalar properties stay floats, which are faster in the residuals
+        assert type(getattr(geoms[0], k)) is float
+    expected = np.array([g.hydraulic_diameter for g in geoms]).T
+    assert np.array(table.hydraulic_diameter) == pytest.approx(expected)
+
+    del data["blockage1"]
+    with pytest.raises(ValueError):
+        GeometryTable.from_columns(data)
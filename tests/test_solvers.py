@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from radcompressor.solvers import (
+    Solver,
+    bracketed_root,
+    root,
+    solver_methods,
+    with_jacobian,
+)
+
+
+def test_root_guess():
+    # Test that a guess and its Jacobian reduce the evaluations
+    def residuals(x, a):
+        # Each residual depends on the previous unknowns, like the diffuser
+        return x**3 + 0.1 * np.cumsum(x) - a * np.linspace(1, 2, len(x))
+
+    x0 = np.ones(8)
+    cold = root(residuals, x0, args=(1.0,))
+    near = root(residuals, x0, cold.x, args=(1.005,))
+    warm = root(residuals, x0, cold.x, cold.jac, args=(1.005,))
+    assert warm.x == pytest.approx(near.x, rel=1e-8)
+    assert warm.nfev < near.nfev < cold.nfev
+
+    # Newton's method with the Jacobian function
+    def jacobian(x, a):
+        return np.diag(3 * x**2) + 0.1 * np.tril(np.ones((len(x), len(x))))
+
+    newton = root(residuals, x0, cold.x, args=(1.005,), jac=jacobian)
+    assert newton.x == pytest.approx(near.x, rel=1e-8)
+    assert newton.nfev <= warm.nfev
+
+    # Falls back to the initial guess
+    bad = root(residuals, x0, np.full(8, -50.0), cold.jac, args=(1.0,))
+    assert bad.x == pytest.approx(cold.x, rel=1e-8)
+
+
+@pytest.mark.parametrize("method", solver_methods)
+def test_solver_methods(method):
+    # Test that the strategies solve the residuals cold and from a guess
+    def residuals(x, a):
+        return x**3 + 0.1 * np.cumsum(x) - a * np.linspace(1, 2, len(x))
+
+    def jacobian(x, a):
+        return np.diag(3 * x**2) + 0.1 * np.tril(np.ones((len(x), len(x))))
+
+    x0 = np.ones(8)
+    ref = root(residuals, x0, args=(1.005,), jac=jacobian)
+    solver = Solver(method, tol=1e-10)
+    for jac in [jacobian, None]:
+        cold = solver.root(residuals, x0, args=(1.005,), jac=jac)
+        assert solver.accepted(cold)
+        assert cold.x == pytest.approx(ref.x, rel=1e-6)
+        assert cold.jac.shape == (8, 8)
+
+    near = root(residuals, x0, args=(1.0,))
+    warm = solver.root(residuals, x0, near.x, near.jac, args=(1.005,))
+    assert warm.x == pytest.approx(ref.x, rel=1e-6)
+    assert 0 < warm.nfev < cold.nfev
+
+    with pytest.raises(ValueError):
+        Solver("krylov")
+
+
+def test_bracketed_root():
+    # Test the safeguarded steps on a mass flux with a maximum, whose root is
+    # on the branch of the bracket
+    def residual(x):
+        return 1 - 2 * x[0] * np.exp(-0.5 * x[0] ** 2)
+
+    def derivative(x):
+        return -2 * (1 - x[0] ** 2) * np.exp(-0.5 * x[0] ** 2)
+
+    ref = 0.59783188
+    f_hi = residual([1.0])
+    for x0, jac in [(None, None), (0.05, None), (0.95, derivative), (0.4, derivative)]:
+        sol = bracketed_root(residual, 0.0, 1.0, 1.0, f_hi, x0, jac)
+        assert sol.success
+        assert sol.x[0] == pytest.approx(ref, rel=1e-8)
+        assert abs(sol.fun[0]) < 1e-10
+        assert sol.nfev < 12
+
+    with pytest.raises(ValueError):
+        bracketed_root(residual, 0.0, 0.4, 1.0, residual([0.4]))
+
+
+def test_with_jacobian_states():
+    # Test that the states of the solution are kept, without evaluation
+    evaluations = []
+
+    def residual(x):
+        evaluations.append(x[0])
+        return [x[0] ** 2 - 2], {"x2": x[0] ** 2}
+
+    fun, jac = with_jacobian(residual, lambda x, states: [[2 * x[0]]])
+    sol = Solver("newton").root(fun, [1.0], jac=jac)
+    n = len(evaluations)
+    assert fun.states(sol.x)["x2"] == pytest.approx(2, rel=1e-12)
+    assert len(evaluations) == n
+    assert fun.states(np.array([3.0]))["x2"] == 9
+    assert len(evaluations) == n + 1
@@ -1,4 +1,26 @@
-from radcompressor.thermo import CoolPropFluid
+import pickle
+import subprocess
+import sys
+import weakref
+
+import numpy as np
+import pytest
+
+from radcompressor.thermo import (
+    CachedFluid,
+    CoolPropFluid,
+    IdealGasFluid,
+    PerfectGasFluid,
+    TabularCoolPropFluid,
+    ThermoException,
+    ThermoPropArray,
+    clear_registry,
+    get_fluid,
+    max_mass_flux,
+    static_derivatives,
+    static_from_total,
+    total_from_static,
+)
 
 
 def test_coolprop_fluid():
@@ -9,3 +31,312 @@ def test_coolprop_fluid():
 
     tp = water.thermo_prop("TQ", 290, 0)
     assert tp.D == 998.7578446208877
+
+
+def test_thermo_prop_outputs():
+    # Test that only the requested transport properties are evaluated
+    fld = CoolPropFluid("R134a")
+    ref = fld.thermo_prop("PT", 3e5, 300)
+    tp = fld.thermo_prop("PT", 3e5, 300, outputs="D")
+    assert tp.D == ref.D
+    assert np.isnan(tp.A) and np.isnan(tp.V)
+    tp = fld.thermo_prop("PT", 3e5, 300, outputs="DV")
+    assert tp.V == ref.V
+    assert np.isnan(tp.A)
+
+
+@pytest.mark.parametrize("cls", [CoolPropFluid, PerfectGasFluid])
+def test_with_outputs(cls):
+    # Test that the skipped properties are those of the full flash
+    if cls is CoolPropFluid:
+        fld = CoolPropFluid("R134a")
+    else:
+        fld = PerfectGasFluid("air", R=287.0, cp=1004.5)
+    ref = fld.thermo_prop("PT", 3e5, 300)
+    tp = fld.thermo_prop("PT", 3e5, 300, outputs="D")
+    assert tp.with_outputs("D") is tp
+    full = tp.with_outputs()
+    for k in "PTDHSAV":
+        assert getattr(full, k) == pytest.approx(getattr(ref, k), rel=1e-9)
+    assert full.with_outputs() is full
+    cached = CachedFluid(fld).thermo_prop("PT", 3e5, 300, outputs="D")
+    assert cached.with_outputs().A == pytest.approx(ref.A, rel=1e-9)
+
+
+def test_thermo_prop_isentropic():
+    # Test that the isentropic conversion matches the HS flash
+    fld = CoolPropFluid("R134a")
+    tot = fld.thermo_prop("PT", 3e5, 300)
+    for speed in [50.0, 200.0, 400.0]:
+        stat = static_from_total(tot, speed)
+        ref = fld.thermo_prop("HS", tot.H - 0.5 * speed**2, tot.S)
+        assert stat.phase == ref.phase
+        for k in ["P", "T", "D", "A"]:
+            assert getattr(stat, k) == pytest.approx(getattr(ref, k), rel=1e-8)
+
+    assert total_from_static(stat, 400.0).P == pytest.approx(tot.P, rel=1e-8)
+
+
+@pytest.mark.parametrize("cls", [CoolPropFluid, PerfectGasFluid])
+def test_static_derivatives(cls):
+    # Test the derivatives of the static density against finite differences
+    if cls is CoolPropFluid:
+        fld = CoolPropFluid("R134a")
+    else:
+        fld = PerfectGasFluid.from_coolprop("R134a")
+    tot = fld.thermo_prop("PT", 3e5, 300)
+    speed = 150.0
+    stat = static_from_total(tot, speed)
+
+    def density(P, H, c):
+        return static_from_total(fld.thermo_prop("PH", P, H), c).D
+
+    h = 1e-6
+    ref = [
+        (density(tot.P, tot.H, speed * (1 + h)) - stat.D) / (speed * h),
+        (density(tot.P * (1 + h), tot.H, speed) - stat.D) / (tot.P * h),
+        (density(tot.P, tot.H * (1 + h), speed) - stat.D) / (tot.H * h),
+    ]
+    assert static_derivatives(tot, stat, speed) == pytest.approx(ref, rel=1e-4)
+    # Isentropic speed of sound
+    assert 1 / stat.derivative("D", "P", "S") == pytest.approx(stat.A**2, rel=1e-6)
+
+
+@pytest.mark.parametrize("cls", [CoolPropFluid, PerfectGasFluid])
+def test_max_mass_flux(cls):
+    # Test that the largest mass flux is at the sonic point of the isentrope
+    if cls is CoolPropFluid:
+        fld = CoolPropFluid("R134a")
+    else:
+        fld = PerfectGasFluid("air", R=287.0, cp=1004.5)
+    tot = fld.thermo_prop("PT", 3e5, 350)
+    sol = max_mass_flux(tot)
+    assert sol.success
+    c = sol.x[0]
+    assert c == pytest.approx(sol.static.A, rel=1e-7)
+    for speed in [0.99 * c, 1.01 * c]:
+        assert speed * static_from_total(tot, speed).D < sol.flux
+
+    if cls is PerfectGasFluid:
+        gamma = fld.cp / (fld.cp - fld.R)
+        ratio = 2 / (gamma + 1)
+        assert c == pytest.approx(tot.A * ratio**0.5, rel=1e-7)
+        flux = tot.D * c * ratio ** (1 / (gamma - 1))
+        assert sol.flux == pytest.approx(flux, rel=1e-7)
+
+
+def test_max_mass_flux_near_critical():
+    # Test that the isentrope of CO2 near its critical point, which becomes
+    # invalid below the sonic speed, gives no sonic point or the largest flux
+    tot = CoolPropFluid("CO2").thermo_prop("PT", 8.5e6, 307)
+    sol = max_mass_flux(tot)
+    for speed in np.linspace(5, 300, 60):
+        stat = static_from_total(tot, speed, errors="nan")
+        if stat.valid and sol.success:
+            assert speed * stat.D <= sol.flux
+
+
+def test_phase_hint():
+    # Test that the gas hint gives the unhinted state and falls back otherwise
+    fld = CoolPropFluid("R134a")
+    for h in [4.05e5, 4.5e5, 3e5]:
+        ref = fld.thermo_prop("PH", 3e5, h)
+        tp = fld.thermo_prop("PH", 3e5, h, phase="gas")
+        assert tp.phase == ref.phase
+        for k in ["T", "D", "S", "A", "V"]:
+            assert getattr(tp, k) == pytest.approx(getattr(ref, k), rel=1e-8)
+        tp = fld.thermo_prop("PS", 3e5, ref.S, phase="gas")
+        assert tp.T == pytest.approx(ref.T, rel=1e-8)
+    assert fld.phase_hint_info() == (6, 2)
+
+
+def test_thermo_prop_errors():
+    # Test that failed flashes give an invalid state with errors="nan"
+    fld = CoolPropFluid("R134a")
+    for f in [fld, CachedFluid(fld)]:
+        with pytest.raises(ThermoException):
+            f.thermo_prop("PT", -1e5, 300)
+        tp = f.thermo_prop("PT", -1e5, 300, errors="nan")
+        assert not tp.valid
+        assert np.isnan(tp.D)
+        assert f.thermo_prop("PT", 1e5, 300, errors="nan").valid
+
+    tot = fld.thermo_prop("PT", 3e5, 300)
+    assert static_from_total(tot, 100, errors="nan").valid
+    assert not static_from_total(tot, 1e4, errors="nan").valid
+
+    # The isentropic Newton iteration converging to a supercritical liquid
+    co2 = CoolPropFluid("CO2")
+    tot = co2.thermo_prop("PT", 15e6, 305)
+    assert static_from_total(tot, 20, errors="nan").valid
+    for c in [60, 150]:
+        assert not static_from_total(tot, c, errors="nan").valid
+    with pytest.raises(ThermoException):
+        static_from_total(tot, 60)
+
+
+@pytest.mark.parametrize("cls", [PerfectGasFluid, IdealGasFluid])
+def test_ideal_gas_fluid(cls):
+    # Test the inversions and the agreement with CoolProp for air
+    fld = cls.from_coolprop("air", T_range=(250.0, 600.0))
+    ref = CoolPropFluid("air").thermo_prop("PT", 2e5, 400)
+    tp = fld.thermo_prop("PT", 2e5, 400)
+    assert tp.phase == ref.phase
+    for k in ["D", "A", "V"]:
+        assert getattr(tp, k) == pytest.approx(getattr(ref, k), rel=5e-3)
+
+    for in_type, in1, in2 in [
+        ("PH", tp.P, tp.H),
+        ("PS", tp.P, tp.S),
+        ("HS", tp.H, tp.S),
+    ]:
+        res = fld.thermo_prop(in_type, in1, in2)
+        assert (res.P, res.T) == pytest.approx((tp.P, tp.T), rel=1e-10)
+
+    with pytest.raises(ThermoException):
+        fld.thermo_prop("TQ", 300, 1)
+
+
+def test_thermo_prop_batch():
+    # Test that the batch flash matches the scalar one and flags failures
+    fld = CoolPropFluid("R134a")
+    P = np.array([3e5, 3e5, 4e5])
+    T = np.array([300.0, 250.0, 310.0])
+    states = fld.thermo_prop_batch("PT", P, T)
+    assert isinstance(states, ThermoPropArray)
+    assert states.valid.tolist() == [True, False, True]
+    assert np.isnan(states.D[1])
+    assert states[0] == fld.thermo_prop("PT", 3e5, 300.0)
+
+    states = fld.thermo_prop_batch("HS", states.H[2], states.S[2])
+    assert states.T == pytest.approx(310.0)
+
+
+def test_tabular_coolprop_fluid():
+    # Test that the table matches HEOS in the gas and two-phase regions
+    heos = CoolPropFluid("R134a")
+    table = TabularCoolPropFluid(
+        "R134a", P_range=(1e5, 2e6), H_range=(2.5e5, 5e5), n_P=60, n_H=60
+    )
+
+    ref = heos.thermo_prop("PT", 3e5, 300)
+    for in_type, in1, in2 in [
+        ("PT", ref.P, ref.T),
+        ("PH", ref.P, ref.H),
+        ("PS", ref.P, ref.S),
+        ("HS", ref.H, ref.S),
+    ]:
+        tp = table.thermo_prop(in_type, in1, in2)
+        assert tp.phase == "gas"
+        for k in ["P", "T", "D", "H", "A", "V"]:
+            assert getattr(tp, k) == pytest.approx(getattr(ref, k), rel=1e-4)
+
+    ref = heos.thermo_prop("PH", 3e5, 3e5)
+    tp = table.thermo_prop("PH", 3e5, 3e5)
+    assert tp.phase == "twophase"
+    for k in ["T", "D", "S", "A", "V"]:
+        assert getattr(tp, k) == pytest.approx(getattr(ref, k), rel=1e-4)
+
+    with pytest.raises(ThermoException):
+        table.thermo_prop("PT", 3e5, 250)
+
+    # The gas-hinted flashes outside the table fall back to HEOS
+    ref = heos.thermo_prop("PT", 3e6, 400)
+    tp = table.thermo_prop("PH", ref.P, ref.H, phase="gas")
+    assert tp.T == pytest.approx(ref.T, rel=1e-8)
+
+    errors = table.error_bounds(n_samples=200)
+    assert max(errors.values()) < 1e-3
+
+
+def test_tabular_cache_dir(tmp_path):
+    # Test that the table is persisted and memory-mapped by the next instance
+    kwargs = dict(P_range=(1e5, 2e6), H_range=(2.5e5, 5e5), n_P=20, n_H=20)
+    fld = TabularCoolPropFluid("R134a", cache_dir=str(tmp_path), **kwargs)
+    assert (tmp_path / fld.table_key()).is_dir()
+
+    fld2 = TabularCoolPropFluid("R134a", cache_dir=str(tmp_path), **kwargs)
+    assert not fld2.table.coeffs.flags.writeable
+    np.testing.assert_array_equal(fld2.table.coeffs, fld._build().coeffs)
+    assert fld2.thermo_prop("PT", 3e5, 300) == fld.thermo_prop("PT", 3e5, 300)
+
+
+def test_cached_fluid():
+    # Test that repeated flashes are served from the cache
+    fld = CachedFluid(CoolPropFluid("R134a"), maxsize=2)
+    assert fld.T_crit == fld.fluid.T_crit
+
+    tp = fld.thermo_prop("PT", 3e5, 300)
+    assert tp.fld is fld
+    assert fld.thermo_prop("PT", 3e5, 300) is tp
+    assert fld.cache_info()[:2] == (1, 1)
+
+    with pytest.raises(ThermoException):
+        fld.thermo_prop("PT", 3e5, 250)
+    with pytest.raises(ThermoException):
+        fld.thermo_prop("PT", 3e5, 250)
+    assert fld.cache_info()[:2] == (2, 2)
+
+    # Least recently used entry is evicted
+    fld.thermo_prop("PT", 4e5, 300)
+    assert fld.cache_info().currsize == 2
+    assert fld.thermo_prop("PT", 3e5, 300) is not tp
+
+    fld = CachedFluid(CoolPropFluid("R134a"), rtol=1e-9)
+    tp = fld.thermo_prop("PT", 3e5, 300)
+    assert fld.thermo_prop("PT", 3e5 * (1 + 1e-12), 300) is tp
+
+
+def test_fluid_registry():
+    # Test that fluids are shared and pickled by reference
+    fld = get_fluid(CoolPropFluid, "R134a")
+    assert get_fluid(CoolPropFluid, name="R134a") is fld
+    tp = fld.thermo_prop("PT", 3e5, 300)
+    assert pickle.loads(pickle.dumps(tp)).fld is fld
+
+    cached = get_fluid(CachedFluid, fld, maxsize=10)
+    assert pickle.loads(pickle.dumps(cached)) is cached
+    assert len(pickle.dumps(cached)) < 500
+
+    # Pickling does not register nor keep alive the unregistered fluids
+    other = CachedFluid(fld, maxsize=20)
+    ref = weakref.ref(other)
+    pickle.dumps(other)
+    del other
+    assert ref() is None
+    copy = pickle.loads(pickle.dumps(CachedFluid(fld, maxsize=20)))
+    assert copy.maxsize == 20 and copy.fluid is fld
+
+    kwargs = dict(P_range=np.array([1e5, 2e6]), H_range=(2.5e5, 5e5), n_P=20, n_H=20)
+    table = get_fluid(TabularCoolPropFluid, "R134a", **kwargs)
+    assert get_fluid(TabularCoolPropFluid, "R134a", **kwargs) is table
+
+    # The shared fluids outlive their users until the registry is cleared
+    ref = weakref.ref(table)
+    del table
+    assert get_fluid(TabularCoolPropFluid, "R134a", **kwargs) is ref()
+    clear_registry()
+    assert ref() is None
+    assert get_fluid(CoolPropFluid, "R134a") is not fld
+
+
+def test_import_time():
+    # Test that no backend is loaded on import and the import time budget
+    code = (
+        "import sys, radcompressor.compressor, radcompressor.plotting;"
+        "print(sorted({'CoolProp', 'ctREFPROP', 'matplotlib'} & set(sys.modules)))"
+    )
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert res.stdout.strip() == "[]"
+    # Self time of the radcompressor modules, dependencies excluded (us)
+    self_time = sum(
+        int(line.split("|")[0].split(":")[1])
+        for line in res.stderr.splitlines()
+        if line.split("|")[-1].strip().startswith("radcompressor")
+    )
+    assert self_time < 100e3
@@ -0,0 +1,158 @@
+import gc
+
+import numpy as np
+import pytest
+
+from radcompressor import solvers, thermo
+from radcompressor.compressor import Compressor
+from radcompressor.condition import OperatingCondition
+from radcompressor.geometry import Geometry
+from radcompressor.thermo import CachedFluid, CoolPropFluid
+from radcompressor.utils import calculate_on_op_grid
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_threaded_op_grid(cached, geom, in0, ub):
+    # Test that threads sharing a fluid give the same results as serial runs
+    fld = CoolPropFluid("R134a")
+    if cached:
+        fld = CachedFluid(fld)
+    in0 = fld.thermo_prop("PT", in0.P, in0.T)
+
+    def results(**kwargs):
+        _, res = calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25, **kwargs)
+        return [(comp.invalid_flag, comp.PR, comp.eff, comp.head) for comp, _ in res]
+
+    serial = results()
+    assert sum(not r[0] for r in serial) > 0
+    for _ in range(3):
+        threaded = results(n_threads=8)
+        np.testing.assert_array_equal(threaded, serial)
+
+
+def test_continuation_op_grid(geom, in0, ub):
+    # Test that chaining the solutions along a speed line gives the same points
+    lb, ub = np.array([0.7, 0.05]) * ub, np.array([0.71, 0.5]) * ub
+
+    def results(**kwargs):
+        _, res = calculate_on_op_grid(geom, in0, lb, ub, [1.0, 0.05], **kwargs)
+        comps = [comp for comp, _ in res]
+        nfev = sum(s.nfev for c in comps for s in (c.ind, c.imp, c.dif) if s)
+        return [(c.invalid_flag, c.PR, c.eff) for c in comps], nfev
+
+    cold, cold_nfev = results()
+    warm, warm_nfev = results(continuation=True)
+    assert sum(not r[0] for r in cold) > 5
+    assert [r[0] for r in warm] == [r[0] for r in cold]
+    np.testing.assert_allclose(np.array(warm)[:, 1:], np.array(cold)[:, 1:], rtol=1e-3)
+    assert warm_nfev < cold_nfev
+    np.testing.assert_array_equal(results(continuation=True, n_threads=2)[0], warm)
+
+
+def test_analytic_jacobians(monkeypatch, geom, in0, ub, op_grid):
+    # Test that the Jacobians of the stages give the points of the forward
+    # differences with fewer evaluations
+    def results(res):
+        comps = [comp for comp, _ in res]
+        nfev = sum(s.nfev for c in comps for s in (c.ind, c.imp, c.dif) if s)
+        return [(c.invalid_flag, c.PR, c.eff) for c in comps], nfev
+
+    analytic, analytic_nfev = results(op_grid[1])
+    monkeypatch.setattr(solvers, "analytic_jacobians", False)
+    fd, fd_nfev = results(calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25)[1])
+    assert sum(not r[0] for r in fd) > 0
+    assert [r[0] for r in analytic] == [r[0] for r in fd]
+    np.testing.assert_allclose(
+        np.array(analytic)[:, 1:], np.array(fd)[:, 1:], rtol=1e-3
+    )
+    assert analytic_nfev < 0.8 * fd_nfev
+
+
+@pytest.mark.parametrize("method", ["lm", "newton", "lite"])
+def test_solver_strategies(method, geom, in0, ub, op_grid):
+    # Test that the strategies of the stages give the points of "hybr"
+    def results(res):
+        return [(c.invalid_flag, c.PR, c.eff) for c, _ in res]
+
+    hybr = results(op_grid[1])
+    strategies = dict.fromkeys(["ind", "imp", "dif"], solvers.Solver(method))
+    _, res = calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25, solvers=strategies)
+    other = results(res)
+    assert sum(not r[0] for r in hybr) > 0
+    assert [r[0] for r in other] == [r[0] for r in hybr]
+    np.testing.assert_allclose(np.array(other)[:, 1:], np.array(hybr)[:, 1:], rtol=1e-4)
+
+
+def test_gas_hint(monkeypatch, geom, in0, ub, op_grid):
+    # Test that the gas hint of the stage flashes gives the same points
+    def results(res):
+        return [(c.invalid_flag, c.PR, c.eff) for c, _ in res]
+
+    hinted = in0.fld.phase_hint_info().hinted
+    monkeypatch.setattr(thermo, "gas_hint", "gas")
+    res = results(calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25)[1])
+    assert in0.fld.phase_hint_info().hinted > hinted
+    assert [r[0] for r in res] == [r[0] for r in results(op_grid[1])]
+    np.testing.assert_allclose(
+        np.array(res)[:, 1:], np.array(results(op_grid[1]))[:, 1:], rtol=1e-8
+    )
+
+
+@pytest.mark.parametrize("marching", [True, False])
+def test_no_reference_cycles(marching, geom, in0, ub):
+    # Test that the solves free their states without the garbage collector
+    dif_kwargs = {"marching": marching}
+    calculate_on_op_grid(geom, in0, 0.1 * ub, ub, 0.25, dif_kwargs=dif_kwargs)
+    gc.collect()
+    gc.disable()
+    try:
+        _, res = calculate_on_op_grid(
+            geom, in0, 0.1 * ub, ub, 0.25, dif_kwargs=dif_kwargs
+        )
+        assert sum(not c.invalid_flag for c, _ in res) > 0
+        del res
+        assert gc.collect() == 0
+    finally:
+        gc.enable()
+
+
+def test_near_critical_co2():
+    # Test that the stages solve without the sonic bracket when the isentrope
+    # of the inlet becomes invalid before its sonic point
+    geom = Geometry.from_dict(
+        dict(
+            r1=0.01,
+            r2s=0.0094,
+            r2h=0.00254,
+            beta2=-45.0,
+            beta2s=-50.0,
+            alpha2=0.0,
+            r4=0.01868,
+            b4=0.00171,
+            beta4=-50.0,
+            n_blades=6,
+            n_splits=6,
+            r5=0.0191,
+            b5=0.00171,
+            blade_e=762e-6,
+            clearance=254e-6,
+            rug_imp=1e-5,
+            backface=254e-6,
+            rug_ind=1e-4,
+            l_ind=0.02,
+            l_comp=0.1137,
+            blockage1=1.0,
+            blockage2=1.0,
+            blockage3=1.0,
+            blockage4=1.0,
+            blockage5=1.0,
+        )
+    )
+    fld = CoolPropFluid("CO2")
+    in0 = fld.thermo_prop("PT", 8.5e6, 307)
+    m_max = 0.7 * in0.A * in0.D * geom.A2_eff
+    n_max = 2.5 * in0.A / geom.r4
+    for fm, fn, valid in [(0.1714, 0.2182, True), (0.05, 0.8318, False)]:
+        op = OperatingCondition(in0=in0, fld=fld, m=fm * m_max, n_rot=fn * n_max)
+        comp = Compressor(geom, op)
+        assert comp.calculate() is valid